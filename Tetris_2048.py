@@ -9,13 +9,49 @@ from lib.picture import Picture  # used for displaying an image on the game menu
 from lib.color import Color  # used for coloring the game menu
 import os  # the os module is used for file and directory operations
 from game_grid import GameGrid  # the class for modeling the game grid
-from tetromino import Tetromino  # the class for modeling the tetrominoes
-import random  # used for creating tetrominoes with random types (shapes)
-import pygame # for soundplay
-import time
-
-# The main function where this program starts execution
-def start():
+from engine import GameEngine  # the class for running the rules of the game
+from engine import LEFT, RIGHT, DOWN, ROTATE, HARD_DROP, TICK, ROWS_CLEARED
+from engine import SPAWNED, LOCKED
+from game_loop import GameLoop  # the fixed-timestep game loop
+from replay import ReplayRecorder  # used for recording the games
+from autoplayer import Autoplayer  # used for letting the computer play
+import profiler  # used for timing the phases of the frames
+import audio  # used for playing the sounds
+from animation import RowFlash, MergePop, FreeFade  # the animations
+import argparse  # for parsing the command line arguments
+import collections  # used for keeping the snapshots for undo
+import time  # used for naming the recorded games
+
+# the game engine actions for the keys used for playing the game
+KEY_ACTIONS = {"left": LEFT, "right": RIGHT, "down": DOWN, "up": ROTATE,
+               "space": HARD_DROP}
+
+# the rate of the game logic (ticks per second), the most frames drawn per
+# second and the number of ticks between two automatic drops (0.3 seconds)
+LOGIC_HZ, MAX_FPS = 60, 60
+DROP_TICKS = round(0.3 * LOGIC_HZ)
+# the keys that repeat when they are held down, the ticks until they start
+# repeating and the ticks between two repeats
+REPEAT_KEYS = ("left", "right", "down")
+REPEAT_DELAY_TICKS, REPEAT_INTERVAL_TICKS = round(0.17 * LOGIC_HZ), round(0.05 * LOGIC_HZ)
+
+# the number of tetrominoes that can be undone
+UNDO_LEVELS = 20
+
+# the number of frames in a cProfile capture (see profiler.py)
+CAPTURE_FRAMES = 300
+
+# the (family, size) of the fonts used for the menu, the game grid and the tiles
+GAME_FONTS = [("Arial", 12), ("Arial", 14), ("Arial", 16), ("Arial", 22),
+              ("Arial", 24), ("Arial", 25), ("Arial", 36)]
+# the fonts used for the first frame of the menu (the others are loaded while
+# the menu is shown)
+MENU_FONTS = [("Arial", 22), ("Arial", 25)]
+
+# The main function where this program starts execution (the computer plays
+# the game when autoplay is set or when it is chosen on the game menu, and the
+# times of the phases of the frames are shown when profile is set)
+def start(record_dir=None, autoplay=False, profile=False, capture_frames=CAPTURE_FRAMES):
    # set the dimensions of the game grid
    grid_h, grid_w = 20, 12
    # set the size of the drawing canvas
@@ -23,215 +59,216 @@ def start():
    stddraw.setCanvasSize(canvas_w, canvas_h)
    stddraw.setXscale(-0.5, grid_w + 6 - 0.5)
    stddraw.setYscale(-0.5, grid_h - 0.5)
-
-   # Initialize game state
-   Tetromino.grid_height = grid_h
-   Tetromino.grid_width = grid_w
-   grid = GameGrid(grid_h, grid_w)
-   current_tetromino = create_tetromino()
-   grid.current_tetromino = current_tetromino
-   grid.next_tetromino = create_tetromino()
-
+   # load only the fonts used on the menu before its first frame is drawn
+   stddraw.preloadFonts(MENU_FONTS)
+   profiler.set_enabled(profile)
+
+   # the game state is initialized while the menu is shown (see load_game):
+   # the engine runs the rules of the game and this function only draws the
+   # game grid and handles the user interaction, every action given to the
+   # engine is recorded with the tick of the game loop in which it happens
+   # (see replay.py) and the snapshots of the game are taken when each of the
+   # last tetrominoes entered the game grid (for undoing them)
+   engine = grid = recorder = history = None
    # Add pause state
    is_paused = False
-   last_time = time.time()  # For tracking time between automatic drops
-
-   display_game_menu(grid_h, grid_w)
-
-   # the main game loop
-   while True:
-      current_time = time.time()
-
-      # check for any user interaction via the keyboard
-      if stddraw.hasNextKeyTyped():
-         key_typed = stddraw.nextKeyTyped().lower()  # make it case insensitive
-
-         # Pause/unpause with 'p'
-         if key_typed == 'p':
-            is_paused = not is_paused
-            grid.display()  # Refresh display to show/hide pause message
-            stddraw.show(0)  # Force immediate display update
-
-         # Restart game with 'r'
-         elif key_typed == 'r':
-            # Reset game state
-            grid = GameGrid(grid_h, grid_w)
-            current_tetromino = create_tetromino()
-            grid.current_tetromino = current_tetromino
-            grid.next_tetromino = create_tetromino()
-            is_paused = False
-            last_time = current_time
-            continue
-
-         # Only process movement keys if not paused
-         if not is_paused:
-            if key_typed == "left":
-               current_tetromino.move(key_typed, grid)
-            elif key_typed == "right":
-               current_tetromino.move(key_typed, grid)
-            elif key_typed == "down":
-               current_tetromino.move(key_typed, grid)
-            elif key_typed == "up":
-               current_tetromino.rotate(grid)
-            elif key_typed == "space":
-               current_tetromino.hard_drop(grid)
-
-         stddraw.clearKeysTyped()
+   # the number of ticks of the game loop until the next automatic drop
+   drop_ticks = DROP_TICKS
+   # the number of ticks each repeating key has been held down for
+   held_ticks = {}
+   # the autoplayer gives one action per tick when autoplay is on
+   autoplayer = None
+
+   # A function that starts a new game
+   def new_game():
+      nonlocal engine, grid, recorder, history, is_paused, drop_ticks
+      engine = GameEngine(GameGrid(grid_h, grid_w))
+      grid = engine.grid
+      recorder = ReplayRecorder(engine)
+      history = collections.deque([recorder.snapshot()], maxlen=UNDO_LEVELS)
+      is_paused = False
+      drop_ticks = DROP_TICKS
+
+   # A function that loads the other fonts and creates the game state and the
+   # autoplayer (called after the first frame of the menu is shown)
+   def load_game():
+      nonlocal autoplayer
+      stddraw.preloadFonts([font for font in GAME_FONTS if font not in MENU_FONTS])
+      new_game()
+      autoplayer = Autoplayer()
+
+   # A function that handles a key pressed down
+   def handle_key(key_typed):
+      nonlocal is_paused, drop_ticks, autoplay
+      # Pause/unpause with 'p'
+      if key_typed == 'p':
+         is_paused = not is_paused
+         # Refresh the whole display to show/hide pause message
+         grid.invalidate()
+         grid.display(0)
+         if is_paused:
+            # Show pause message
+            stddraw.setFontSize(36)
+            stddraw.setPenColor(Color(180, 70, 100))
+            stddraw.text(grid_w / 2, grid_h / 2, "PAUSED")
+            stddraw.show(0)
+
+      # Restart game with 'r'
+      elif key_typed == 'r':
+         # Reset game state
+         save_replay(recorder, record_dir)
+         new_game()
+
+      # Undo the last tetromino locked onto the game grid with 'u' (the game
+      # goes back to when that tetromino entered the game grid)
+      elif key_typed == 'u' and not is_paused:
+         if len(history) > 1:
+            history.pop()
+         recorder.restore(history[-1])
+         drop_ticks = DROP_TICKS
+
+      # Turn the autoplayer on/off with 'a'
+      elif key_typed == 'a':
+         autoplay = not autoplay
+
+      # Show/hide the times of the phases of the frames with 'o'
+      elif key_typed == 'o':
+         profiler.set_enabled(not profiler.is_enabled())
+
+      # Write a cProfile capture of the next frames to a file with 'c'
+      elif key_typed == 'c':
+         profiler.start_capture(capture_frames, "frames-%d.prof" % time.time())
+
+      # Only process movement keys if not paused
+      elif not is_paused and key_typed in KEY_ACTIONS:
+         play(KEY_ACTIONS[key_typed])
+
+   # A function that gives an action to the game engine (through the replay
+   # recorder) and handles the events
+   def play(action):
+      with profiler.phase("logic"):
+         events = recorder.step(loop.ticks, action)
+      handle_events(grid, events)
+      if any(event == SPAWNED for event, value in events):
+         history.append(recorder.snapshot())
+
+   # A function that runs one tick of the game logic (timed as a whole by the
+   # profiler)
+   def update(dt):
+      with profiler.phase("update"):
+         tick()
+
+   # A function for one tick of the game logic: the keys typed, the automatic
+   # drop and the end of the game
+   def tick():
+      nonlocal drop_ticks
+      # handle every key pressed since the last tick in the order they were
+      # pressed (the keys are made case insensitive)
+      with profiler.phase("input"):
+         while stddraw.hasNextKeyEvent():
+            kind, key, _ = stddraw.nextKeyEvent()
+            if kind == stddraw.KEY_DOWN:
+               handle_key(key.lower())
+               if key in REPEAT_KEYS:
+                  held_ticks[key] = 0
+            else:
+               held_ticks.pop(key, None)
+         stddraw.clearKeysTyped()  # the same keys are read as key events
 
       # Skip game logic if paused
       if is_paused:
-         # Show pause message
-         stddraw.setFontSize(36)
-         stddraw.setPenColor(Color(180, 70, 100))
-         stddraw.text(grid_w / 2, grid_h / 2, "PAUSED")
-         stddraw.show(0)
-         continue
-
-      # Automatic downward movement (once per second)
-      if current_time - last_time > 0.3:  # 1 second has passed
-         last_time = current_time
-         # move the active tetromino down by one
-         success = current_tetromino.move("down", grid)
-
-         if not success:
-            # get the tile matrix of the tetromino without empty rows and columns
-            # and the position of the bottom left cell in this matrix
-            tiles, pos = current_tetromino.get_min_bounded_tile_matrix(True)
-            # update the game grid by locking the tiles of the landed tetromino
-            game_over = grid.update_grid(tiles, pos)
-
-            grid.remove_full_rows()
-
-            # end the main game loop if the game is over
-            if game_over:
-               # Show win/lose message
-               stddraw.setFontSize(36)
-               stddraw.setPenColor(Color(180, 70, 100))
-
-               if grid.has_won:
-                  stddraw.text(grid_w / 2, grid_h / 2, "YOU WIN!")
-               else:
-                  stddraw.text(grid_w / 2, grid_h / 2, "GAME OVER!")
-
-               stddraw.show(3000)
-               break
-
-            # create the next tetromino to enter the game grid
-            current_tetromino = grid.next_tetromino
-            grid.current_tetromino = current_tetromino
-            grid.next_tetromino = create_tetromino()
-
-      grid.display()
-      stddraw.show(50)  # Show for 50ms (controls game speed)
-
-   print("Game over")
+         return
 
-   # the main game loop
-   while True:
-      # check for any user interaction via the keyboard
-      if stddraw.hasNextKeyTyped():  # check if the user has pressed a key
-         key_typed = stddraw.nextKeyTyped().lower()  # make it case insensitive
-
-         # Pause/unpause with 'p'
-         if key_typed == 'p':
-            is_paused = not is_paused
-            if is_paused:
-               # Show pause message
-               stddraw.setFontFamily("Arial")
-               stddraw.setFontSize(48)
-               stddraw.setPenColor(Color(255, 0, 0))
-               stddraw.text(grid_w / 2, grid_h / 2, "PAUSED")
-               stddraw.show(100)
-
-         # Restart game with 'r'
-         elif key_typed == 'r':
-            # Reset game state
-            grid = GameGrid(grid_h, grid_w)
-            current_tetromino = create_tetromino()
-            grid.current_tetromino = current_tetromino
-            grid.next_tetromino = create_tetromino()
-            is_paused = False
+      # the keys held down repeat their action after a delay (delayed auto
+      # shift) at a fixed rate (auto repeat)
+      for key in list(held_ticks):
+         if not stddraw.isKeyHeld(key):
+            del held_ticks[key]
             continue
-
-         # if the left arrow key has been pressed
-         if key_typed == "left":
-            # move the active tetromino left by one
-            current_tetromino.move(key_typed, grid)
-         # if the right arrow key has been pressed
-         elif key_typed == "right":
-            # move the active tetromino right by one
-            current_tetromino.move(key_typed, grid)
-         # if the down arrow key has been pressed
-         elif key_typed == "down":
-            # move the active tetromino down by one
-            # (soft drop: causes the tetromino to fall down faster)
-            current_tetromino.move(key_typed, grid)
-         # rotation
-         elif key_typed == "up":
-            current_tetromino.rotate(grid)
-         # hard drop
-         elif key_typed == "space":
-            current_tetromino.hard_drop(grid)
-         # clear the queue of the pressed keys for a smoother interaction
-         stddraw.clearKeysTyped()
-
-         # Skip game logic if paused
+         held_ticks[key] += 1
+         repeat_ticks = held_ticks[key] - REPEAT_DELAY_TICKS
+         if repeat_ticks >= 0 and repeat_ticks % REPEAT_INTERVAL_TICKS == 0:
+            handle_key(key)
+
+      # the autoplayer plays one action per tick (it plans the placement of
+      # each new tetromino within the tick)
+      if autoplay:
+         with profiler.phase("autoplay"):
+            action = autoplayer.next_action(engine)
+         play(action)
+
+      # Automatic downward movement (every DROP_TICKS ticks)
+      drop_ticks -= 1
+      if drop_ticks <= 0:
+         drop_ticks = DROP_TICKS
+         # move the active tetromino down by one (it is locked onto the game
+         # grid when it cannot go down anymore)
+         play(TICK)
+
+      # end the main game loop if the game is over
+      if engine.game_over:
+         loop.stop()
+
+   # A function that draws a frame (only the changes, see GameGrid.display)
+   def render():
+      with profiler.phase("render"):
          if is_paused:
-            grid.display()
-            continue
+            stddraw.showRegions([])  # nothing changes, only the keys are read
+         else:
+            grid.display(0)
+      profiler.end_frame()
 
-      # move the active tetromino down by one at each iteration (auto fall)
-      success = current_tetromino.move("down", grid)
-      # lock the active tetromino onto the grid when it cannot go down anymore
-      if not success:
-         # get the tile matrix of the tetromino without empty rows and columns
-         # and the position of the bottom left cell in this matrix
-         tiles, pos = current_tetromino.get_min_bounded_tile_matrix(True)
-         # update the game grid by locking the tiles of the landed tetromino
-         game_over = grid.update_grid(tiles, pos)
-
-         grid.remove_full_rows()
-
-         # end the main game loop if the game is over
-         if game_over:
-            # Show win/lose message
-            stddraw.setFontSize(36)
-            stddraw.setPenColor(Color(180, 70, 100))
-            
-            if grid.has_won:
-               stddraw.text(grid.grid_width / 2, grid.grid_height / 2, "YOU WIN!")
-            else:
-               stddraw.text(grid.grid_width / 2, grid.grid_height / 2, "GAME OVER!")
-            
-            stddraw.show(3000)
-          
-            break
-         
+   if display_game_menu(grid_h, grid_w, load_game):
+      autoplay = True
+
+   # the main game loop (the game logic runs at LOGIC_HZ ticks per second
+   # however long drawing takes, and at most MAX_FPS frames are drawn)
+   loop = GameLoop(update, render, LOGIC_HZ, MAX_FPS)
+   loop.run()
+   save_replay(recorder, record_dir)
 
+   # Show win/lose message
+   grid.display(0)
+   stddraw.setFontSize(36)
+   stddraw.setPenColor(Color(180, 70, 100))
 
-         # create the next tetromino to enter the game grid
-         current_tetromino = grid.next_tetromino  # Use the next tetromino
-         grid.current_tetromino = current_tetromino
-         grid.next_tetromino = create_tetromino()  # Create a new next tetromino
+   if engine.has_won:
+      stddraw.text(grid_w / 2, grid_h / 2, "YOU WIN!")
+   else:
+      stddraw.text(grid_w / 2, grid_h / 2, "GAME OVER!")
 
-      # display the game grid with the current tetromino
-      grid.display()
+   stddraw.show(3000)
 
-   # print a message on the console when the game is over
    print("Game over")
 
-# A function for creating random shaped tetrominoes to enter the game grid
-def create_tetromino():
-   # the type (shape) of the tetromino is determined randomly
-   tetromino_types = ['I','O','Z','L','J','S','T']
-   random_index = random.randint(0, len(tetromino_types) - 1)
-   random_type = tetromino_types[random_index]
-   # create and return the tetromino
-   tetromino = Tetromino(random_type)
-   return tetromino
-
-# A function for displaying a simple menu before starting the game
-def display_game_menu(grid_height, grid_width):
+# A function for saving the game recorded by the given recorder to the given
+# directory (nothing is saved when the directory is None)
+def save_replay(recorder, record_dir):
+   if record_dir is None:
+      return
+   os.makedirs(record_dir, exist_ok=True)
+   filename = "game-%d-%d.t2kr" % (recorder.engine.seed, time.time())
+   recorder.finish().save(os.path.join(record_dir, filename))
+
+# A function for playing the sound and the animations of the events returned
+# by the game engine (the animations are played by the game grid over the
+# next frames, while the game goes on)
+def handle_events(grid, events):
+   for event, value in events:
+      if event == LOCKED:
+         # the merged tiles pop and the free tiles fade out
+         if grid.merged_cells:
+            grid.animations.add(MergePop(grid.merged_cells))
+         if grid.freed_tiles:
+            grid.animations.add(FreeFade(grid.freed_tiles, grid.empty_cell_color))
+      elif event == ROWS_CLEARED:
+         audio.play("row_clear")
+         grid.animations.add(RowFlash(value, grid.grid_width))
+
+# A function for displaying a simple menu before starting the game, which
+# calls the given function (if any) once the menu is shown, to load the game
+# meanwhile, and returns True when the computer is chosen to play the game
+def display_game_menu(grid_height, grid_width, load=None):
    # the colors used for the menu
    background_color = Color(255, 230, 240)  # Light pink background
    button_color = Color(255, 180, 200)  # Medium pink button
@@ -245,10 +282,6 @@ def display_game_menu(grid_height, grid_width):
    img_file = current_dir + "/images/menu_image.png"
    # the coordinates to display the image centered horizontally
    img_center_x, img_center_y = (grid_width - 1) / 2, grid_height - 7
-   # the image is modeled by using the Picture class
-   image_to_display = Picture(img_file)
-   # add the image to the drawing canvas
-   stddraw.picture(image_to_display, img_center_x, img_center_y)
 
    # the dimensions for the start game button
    button_w, button_h = grid_width - 1.5, 2
@@ -263,6 +296,12 @@ def display_game_menu(grid_height, grid_width):
    stddraw.setPenColor(text_color)
    text_to_display = "START"
    stddraw.text(img_center_x, 5, text_to_display)
+   # add the autoplay button below the start game button
+   ai_button_blc_y = 1
+   stddraw.setPenColor(button_color)
+   stddraw.filledRectangle(button_blc_x, ai_button_blc_y, button_w, button_h)
+   stddraw.setPenColor(text_color)
+   stddraw.text(img_center_x, 2, "AUTOPLAY")
 
    # Add 3-line text on the right side of the menu
    stddraw.setFontFamily("Arial")
@@ -284,6 +323,18 @@ def display_game_menu(grid_height, grid_width):
    stddraw.text(text_x, center_y, line2)
    stddraw.text(text_x, center_y - line_spacing, line3)
 
+   # show the menu at once, and then load the image (which does not overlap
+   # the rest of the menu), the sounds and the game while the menu is shown
+   stddraw.show(0)
+   # the image is modeled by using the Picture class
+   image_to_display = Picture(img_file)
+   # add the image to the drawing canvas
+   stddraw.picture(image_to_display, img_center_x, img_center_y)
+   # initialize the mixer and decode the sounds before the game starts
+   audio.init()
+   if load is not None:
+      load()
+
    # the user interaction loop for the simple menu
    while True:
       # display the menu and wait for a short time (50 ms)
@@ -293,15 +344,27 @@ def display_game_menu(grid_height, grid_width):
          # get the coordinates of the most recent location at which the mouse
          # has been left-clicked
          mouse_x, mouse_y = stddraw.mouseX(), stddraw.mouseY()
-         # check if these coordinates are inside the button
+         # check if these coordinates are inside one of the buttons
          if mouse_x >= button_blc_x and mouse_x <= button_blc_x + button_w:
             if mouse_y >= button_blc_y and mouse_y <= button_blc_y + button_h:
-               pygame.mixer.init()
-               pygame.mixer.music.load('tetris99.mp3')
-               pygame.mixer.music.set_volume(0.06)
-               pygame.mixer.music.play(-1)
-               break  # break the loop to end the method and start the game
+               autoplay = False
+            elif mouse_y >= ai_button_blc_y and mouse_y <= ai_button_blc_y + button_h:
+               autoplay = True
+            else:
+               continue
+            audio.play_music()
+            return autoplay  # end the method and start the game
 # start() function is specified as the entry point (main function) from which
 # the program starts execution
 if __name__ == '__main__':
-   start()
+   parser = argparse.ArgumentParser(description="Play Tetris 2048.")
+   parser.add_argument("--record", metavar="DIR", default=None,
+                       help="save a replay of every game to this directory")
+   parser.add_argument("--ai", action="store_true",
+                       help="let the computer play the game (see autoplayer.py)")
+   parser.add_argument("--profile", action="store_true",
+                       help="show the times of the phases of the frames (see profiler.py)")
+   parser.add_argument("--capture-frames", type=int, default=CAPTURE_FRAMES,
+                       help="the number of frames in a cProfile capture (key C)")
+   args = parser.parse_args()
+   start(args.record, args.ai, args.profile, args.capture_frames)
@@ -0,0 +1,130 @@
+################################################################################
+#                                                                              #
+# The animations of Tetris 2048                                                #
+#                                                                              #
+# Each effect (a flash of the cleared rows, a pop of the merged tiles or a     #
+# fade of the free tiles) lasts for a given time from when it is added to a    #
+# timeline, which is updated once a frame. Nothing waits for an effect: the    #
+# game grid draws the cells covered by the effects over its tiles in each      #
+# frame (see GameGrid.display), so the game logic and the user input go on at  #
+# their full rate while the effects are played.                                #
+#                                                                              #
+# Each effect has the (row, col) cells it covers, its duration in seconds and  #
+# the time it was added to a timeline (start), and two methods: get_key, which #
+# returns what it shows on its cells at a fraction (from 0 to 1) of its time   #
+# or None when it shows nothing (the cells are drawn again only when this      #
+# changes), and draw, which draws what a key shows on a cell at a position.    #
+#                                                                              #
+################################################################################
+
+import time  # the monotonic clock used for timing the effects
+import lib.stddraw as stddraw  # used for drawing the effects
+from lib.color import Color  # used for coloring the effects
+
+# the color of the cleared rows when they flash and of the rings of the pops
+FLASH_COLOR = Color(255, 255, 255)
+# the duration of each effect in seconds, the number of times the cleared
+# rows flash and the number of steps of the pops and the fades
+ROW_FLASH_TIME, MERGE_POP_TIME, FREE_FADE_TIME = 0.3, 0.2, 0.3
+ROW_FLASHES = 3
+POP_STEPS, FADE_STEPS = 4, 4
+
+# A class for the flashes of the cleared rows (where the rows above them
+# have moved down)
+class RowFlash:
+   def __init__(self, rows, grid_width):
+      self.cells = [(row, col) for row in rows for col in range(grid_width)]
+      self.duration = ROW_FLASH_TIME
+      self.start = None  # the time at which it is added to a timeline
+
+   def get_key(self, progress):
+      # the rows are covered in the first half of each flash
+      return "flash" if int(progress * 2 * ROW_FLASHES) % 2 == 0 else None
+
+   def draw(self, key, cell, position):
+      stddraw.setPenColor(FLASH_COLOR)
+      stddraw.filledSquare(position.x, position.y, 0.5)
+
+# A class for the pops of the tiles whose numbers have changed by merges (a
+# ring that shrinks into the tile)
+class MergePop:
+   def __init__(self, cells):
+      self.cells = cells
+      self.duration = MERGE_POP_TIME
+      self.start = None
+
+   def get_key(self, progress):
+      return ("pop", int(progress * POP_STEPS))
+
+   def draw(self, key, cell, position):
+      stddraw.setPenColor(FLASH_COLOR)
+      stddraw.setPenRadius(0.006)
+      stddraw.square(position.x, position.y, 0.45 - 0.1 * key[1])
+      stddraw.setPenRadius()
+
+# A class for the fades of the free tiles removed from the game grid, given as
+# (tile, (row, col)), towards the given background color
+class FreeFade:
+   def __init__(self, tile_cells, background_color):
+      self.cells = [cell for tile, cell in tile_cells]
+      self.duration = FREE_FADE_TIME
+      self.start = None
+      self.tiles = {cell: tile for tile, cell in tile_cells}
+      self.background_color = background_color
+
+   def get_key(self, progress):
+      return ("fade", int(progress * FADE_STEPS))
+
+   def draw(self, key, cell, position):
+      # the color of the tile is mixed with the background color step by step
+      # and the tile shrinks
+      fraction = (key[1] + 1) / (FADE_STEPS + 1)
+      color = self.tiles[cell].background_color
+      background = self.background_color
+      stddraw.setPenColor(Color(
+         *(round(c + (b - c) * fraction) for c, b in
+           zip((color.getRed(), color.getGreen(), color.getBlue()),
+               (background.getRed(), background.getGreen(), background.getBlue())))))
+      stddraw.filledSquare(position.x, position.y, 0.5 * (1 - fraction / 2))
+
+# A class for the effects that are being played, which are updated once a
+# frame by the time on the given clock
+class Timeline:
+   def __init__(self, clock=time.perf_counter):
+      self.clock = clock
+      self.effects = []
+      # the (effect, key) shown on each covered (row, col) cell after the last
+      # update (the effect added last is shown on top)
+      self.overlays = {}
+
+   # A method for starting to play the given effect
+   def add(self, effect):
+      effect.start = self.clock()
+      self.effects.append(effect)
+
+   # A method for ending all the effects
+   def clear(self):
+      self.effects = []
+      self.overlays = {}
+
+   # A method for ending the effects whose time is over and finding what the
+   # others show on their cells now
+   def update(self):
+      now = self.clock()
+      self.effects = [effect for effect in self.effects
+                      if now - effect.start < effect.duration]
+      self.overlays = {}
+      for effect in self.effects:
+         key = effect.get_key((now - effect.start) / effect.duration)
+         if key is not None:
+            for cell in effect.cells:
+               self.overlays[cell] = (effect, key)
+      return self.overlays
+
+   # A method for drawing the effect shown on the given cell (if any) at the
+   # given position
+   def draw(self, cell, position):
+      overlay = self.overlays.get(cell)
+      if overlay is not None:
+         effect, key = overlay
+         effect.draw(key, cell, position)
@@ -0,0 +1,70 @@
+################################################################################
+#                                                                              #
+# The sound effects and the music of Tetris 2048                               #
+#                                                                              #
+# The mixer is initialized once by init, which also decodes every sound       #
+# effect into a Sound object and loads the music, where the files are found   #
+# next to this code file (not in the current working directory). Each sound    #
+# effect is played on its own reserved channel, so playing it never waits for  #
+# another sound and a sound effect played again cuts off its last play. When  #
+# there is no audio device (or a file is missing) the sounds are left out and  #
+# the functions do nothing.                                                    #
+#                                                                              #
+################################################################################
+
+import os  # used for finding the sound files
+import pygame  # the mixer plays the sounds
+
+# the directory of the sound files (the directory of this code file)
+SOUND_DIR = os.path.dirname(os.path.realpath(__file__))
+# the (file, volume) of each sound effect and of the music
+EFFECTS = {"row_clear": ("bubblepop.mp3", 0.2)}
+MUSIC = ("tetris99.mp3", 0.06)
+# the settings of the mixer (a small buffer so that the sounds start at once)
+FREQUENCY, BUFFER_SIZE = 44100, 512
+
+# the channel and the Sound object of each sound effect that was loaded, and
+# whether the mixer was initialized and the music was loaded
+_effects = {}
+_initialized = False
+_music_loaded = False
+
+# A function for initializing the mixer and loading the sounds (only the first
+# call does anything), which returns False when there is no audio
+def init():
+   global _initialized, _music_loaded
+   if _initialized:
+      return pygame.mixer.get_init() is not None
+   _initialized = True
+   try:
+      pygame.mixer.pre_init(FREQUENCY, -16, 2, BUFFER_SIZE)
+      pygame.mixer.init()
+   except pygame.error:
+      return False  # no audio device, the sounds are left out
+   # one reserved channel for each sound effect (the music has its own)
+   pygame.mixer.set_reserved(len(EFFECTS))
+   for index, (name, (filename, volume)) in enumerate(EFFECTS.items()):
+      try:
+         sound = pygame.mixer.Sound(os.path.join(SOUND_DIR, filename))
+      except (pygame.error, FileNotFoundError):
+         continue  # the sound effect is left out
+      sound.set_volume(volume)
+      _effects[name] = (pygame.mixer.Channel(index), sound)
+   try:
+      pygame.mixer.music.load(os.path.join(SOUND_DIR, MUSIC[0]))
+      pygame.mixer.music.set_volume(MUSIC[1])
+      _music_loaded = True
+   except (pygame.error, FileNotFoundError):
+      pass  # the game is played without music
+   return True
+
+# A function for playing the sound effect with the given name
+def play(name):
+   if name in _effects:
+      channel, sound = _effects[name]
+      channel.play(sound)
+
+# A function for playing the music again and again
+def play_music():
+   if _music_loaded:
+      pygame.mixer.music.play(-1)
@@ -0,0 +1,170 @@
+################################################################################
+#                                                                              #
+# An autoplayer for Tetris 2048                                                #
+#                                                                              #
+# Every rotation and column the current tetromino can reach is tried at once  #
+# on a batch of copies of the game grid (lock, merges, free tiles and cleared  #
+# rows, see batch_engine.py) and the results are scored with a weighted       #
+# heuristic. The best few placements are tried again with every placement of  #
+# the next tetromino, and the actions for the best one are played. It can be  #
+# used as a policy for selfplay.py with --policy autoplayer:ai_policy.         #
+#                                                                              #
+################################################################################
+
+import collections  # used for the breadth-first search and the planned actions
+import numpy as np  # the fundamental Python module for scientific computing
+from batch_engine import BatchEngine  # used for trying all the placements
+from engine import GameEngine  # the shapes of the tetrominoes
+from engine import LEFT, RIGHT, ROTATE, HARD_DROP, TICK  # the actions
+
+# the weights of the heuristic, for the score gained and for the features of
+# the game grid after the placements (see bit_grid.board_features)
+WEIGHTS = {"score": 0.02, "aggregate_height": -0.5, "max_height": -0.3,
+           "bumpiness": -0.2, "holes": -3.0, "tiles": -0.3}
+# the number of the best placements of the current tetromino that are tried
+# with every placement of the next tetromino
+BEAM_WIDTH = 4
+
+# A function that returns a batch engine with one game for each of the given
+# (board index, rotation, x) placements of the given tetromino at row y, where
+# the board and the score of each game are taken from the given arrays
+def make_batch(boards, scores, tetromino, placements, y):
+   grid_h, grid_w = boards.shape[1:]
+   batch = BatchEngine(len(placements), grid_h, grid_w)
+   index, rotation, x = (np.array(column) for column in zip(*placements))
+   batch.boards[:] = boards[index]
+   batch.score[:] = scores[index]
+   batch.shape[:] = GameEngine.tetromino_types.index(tetromino.type)
+   batch.tiles[:] = [tile.number.bit_length() - 1 for tile in tetromino.tiles]
+   batch.rotation[:], batch.x[:], batch.y[:] = rotation, x, y
+   return batch
+
+# A function that returns a batch engine with a game for each (rotation, x)
+# position of the given tetromino at row y on each of the given boards
+# (starting with the given scores) together with the list of the positions,
+# where the game for position i on board b has the index b * len(positions) + i
+def make_position_batch(boards, scores, tetromino, y):
+   positions = [(rotation, x) for rotation in range(4)
+                for x in range(1 - tetromino.rotation_states[0].n, boards.shape[2])]
+   batch = make_batch(boards, scores, tetromino,
+                      [(board,) + position for board in range(len(boards))
+                       for position in positions], y)
+   return batch, positions
+
+# A function that returns the positions a tetromino can reach from the given
+# rotation state and column by rotating and moving at the same row, given the
+# positions at which it fits there, as a dictionary {(rotation, x): actions}
+# where the actions rotate and move the tetromino there (a breadth-first
+# search)
+def reachable_placements(fitting, rotation, x):
+   placements = {(rotation, x): ()}
+   queue = collections.deque([(rotation, x)])
+   while queue:
+      rotation, x = queue.popleft()
+      actions = placements[(rotation, x)]
+      for action, position in ((ROTATE, ((rotation + 1) % 4, x)),
+                               (LEFT, (rotation, x - 1)), (RIGHT, (rotation, x + 1))):
+         if position in fitting and position not in placements:
+            placements[position] = actions + (action,)
+            queue.append(position)
+   return placements
+
+# A function that returns the reachable placements (see reachable_placements)
+# of the tetromino on each board of a batch made by make_position_batch from
+# the given rotation state and column, as a list with one dictionary for each
+# board (None for a board on which the tetromino does not fit there)
+def board_placements(batch, positions, rotation, x):
+   games = np.arange(batch.n_games)
+   fits = batch.can_be_placed(games, batch.rotation, batch.x, batch.y)
+   result = []
+   for row in fits.reshape(-1, len(positions)):
+      fitting = {positions[i] for i in np.flatnonzero(row)}
+      result.append(reachable_placements(fitting, rotation, x)
+                    if (rotation, x) in fitting else None)
+   return result
+
+# A function that drops and locks the tetrominoes of the given games of the
+# given batch engine and returns the value of each resulting game grid by the
+# given weights (-inf for a lost game and inf for a won game)
+def evaluate(batch, games, weights):
+   batch.hard_drop(games)
+   batch.settle(games)
+   values = weights["score"] * batch.score.astype(np.float64)
+   for name, feature in batch.features().items():
+      values += weights[name] * feature
+   values[batch.game_over] = -np.inf
+   values[batch.has_won] = np.inf
+   return values[games]
+
+# A function that returns the actions that place the current tetromino of the
+# given game engine in the best way (ending with a hard drop and a tick that
+# locks it), looking ahead to the next tetromino for the best placements
+def plan(engine, weights=WEIGHTS, beam_width=BEAM_WIDTH):
+   grid_h = engine.grid.grid_height
+   tetromino, next_tetromino = engine.current_tetromino, engine.next_tetromino
+   x, y = tetromino.bottom_left_cell.x, tetromino.bottom_left_cell.y
+   # every placement of the current tetromino (the score gained is counted
+   # from 0)
+   first, positions = make_position_batch(engine.grid.get_exponents()[None],
+                                          np.zeros(1, dtype=np.int64), tetromino, y)
+   placements = board_placements(first, positions, tetromino.rotation, x)[0]
+   games = np.array([positions.index(position) for position in placements])
+   actions = list(placements.values())
+   values = evaluate(first, games, weights)
+   best = int(np.argmax(values))
+   # every placement of the next tetromino after the best placements (the
+   # next tetromino enters the game grid at its initial position)
+   beam = [int(i) for i in np.argsort(-values, kind='stable')[:beam_width]
+           if not first.game_over[games[i]]]
+   if beam and values[best] != np.inf:
+      second, next_positions = make_position_batch(
+         first.boards[games[beam]], first.score[games[beam]], next_tetromino, grid_h - 1)
+      next_games, parents = [], []
+      for index, placements in enumerate(board_placements(
+            second, next_positions, 0, next_tetromino.bottom_left_cell.x)):
+         if placements is not None:  # otherwise the next tetromino cannot enter
+            next_games += [index * len(next_positions) + next_positions.index(position)
+                           for position in placements]
+            parents += [index] * len(placements)
+      if next_games:
+         next_values = evaluate(second, np.array(next_games), weights)
+         beam_values = np.full(len(beam), -np.inf)
+         np.maximum.at(beam_values, parents, next_values)
+         if beam_values.max() > values[best]:
+            best = beam[int(np.argmax(beam_values))]
+   return list(actions[best]) + [HARD_DROP, TICK]
+
+# A class for an autoplayer that gives the game engine one action at a time,
+# planning again when a new tetromino enters the game grid or when the
+# tetromino is not where the planned actions have taken it
+class Autoplayer:
+   def __init__(self, weights=WEIGHTS, beam_width=BEAM_WIDTH):
+      self.weights = weights
+      self.beam_width = beam_width
+      self.tetromino = None
+      self.actions = collections.deque()
+      self.expected = None  # the (rotation, x) after the last action
+
+   # A method that returns the next action for the given game engine
+   def next_action(self, engine):
+      tetromino = engine.current_tetromino
+      position = (tetromino.rotation, tetromino.bottom_left_cell.x)
+      if tetromino is not self.tetromino or position != self.expected or not self.actions:
+         self.tetromino = tetromino
+         self.actions = collections.deque(plan(engine, self.weights, self.beam_width))
+         self.expected = position
+      action = self.actions.popleft()
+      rotation, x = self.expected
+      if action == ROTATE:
+         self.expected = ((rotation + 1) % 4, x)
+      elif action == LEFT or action == RIGHT:
+         self.expected = (rotation, x - 1 if action == LEFT else x + 1)
+      return action
+
+# the autoplayer used by ai_policy (one per process, it plans again for each
+# new tetromino so it can play one game after another)
+_autoplayer = Autoplayer()
+
+# A policy for selfplay.py that plays the actions of the autoplayer
+def ai_policy(engine, rng):
+   return _autoplayer.next_action(engine)
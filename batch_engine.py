@@ -0,0 +1,326 @@
+from tetromino import ROTATION_STATES  # the rotation states of the shapes
+from engine import GameEngine, ACTIONS  # the shapes and the actions
+from bit_grid import merge_columns  # the vertical merges of the tiles
+import numpy as np  # the fundamental Python module for scientific computing
+
+# the codes of the actions given to BatchEngine.step (indexes in ACTIONS)
+LEFT, RIGHT, DOWN, ROTATE, HARD_DROP, TICK = range(len(ACTIONS))
+# the code of the action that does nothing
+NO_ACTION = -1
+
+# A function that builds the tables of the given cells of every rotation state
+# of every shape as (shape, rotation, cell) arrays of the column offsets, the
+# row offsets above the bottom left cell and a flag for the used entries
+def build_cell_tables(get_cells):
+   n_shapes = len(GameEngine.tetromino_types)
+   dx = np.zeros((n_shapes, 4, 4), dtype=np.int64)
+   dy = np.zeros((n_shapes, 4, 4), dtype=np.int64)
+   valid = np.zeros((n_shapes, 4, 4), dtype=bool)
+   for shape_index, shape in enumerate(GameEngine.tetromino_types):
+      for rotation, state in enumerate(ROTATION_STATES[shape]):
+         cells = get_cells(state)
+         for i, (col, row_dy) in enumerate(cells):
+            dx[shape_index, rotation, i] = col
+            dy[shape_index, rotation, i] = row_dy
+            valid[shape_index, rotation, i] = True
+   return dx, dy, valid
+
+# A function that lists the cells of row bitmasks as (col, dy) pairs
+def mask_cells(row_masks):
+   return [(col, dy) for dy, mask in row_masks
+           for col in range(mask.bit_length()) if (mask >> col) & 1]
+
+# the tables of the tiles (in the order of the tiles) and of the tiles that
+# lead a move to the left, to the right and down
+TILE_CELLS = build_cell_tables(
+   lambda state: [(col, state.n - 1 - row) for row, col in state.cells])
+LEFT_EDGES = build_cell_tables(lambda state: mask_cells(state.left_edges))
+RIGHT_EDGES = build_cell_tables(lambda state: mask_cells(state.right_edges))
+DOWN_EDGES = build_cell_tables(lambda state: mask_cells(state.down_edges))
+# the size of the tile matrix of each shape and the bounds of the rotation states
+SHAPE_SIZES = np.array([ROTATION_STATES[shape][0].n
+                        for shape in GameEngine.tetromino_types])
+MIN_COLS = np.array([[state.min_col for state in ROTATION_STATES[shape]]
+                     for shape in GameEngine.tetromino_types])
+MAX_COLS = np.array([[state.max_col for state in ROTATION_STATES[shape]]
+                     for shape in GameEngine.tetromino_types])
+MIN_DYS = np.array([[state.min_dy for state in ROTATION_STATES[shape]]
+                    for shape in GameEngine.tetromino_types])
+
+# A class that plays N games in lockstep with the rules of GameEngine and
+# GameGrid, keeping the game grids as an (N, grid_h, grid_w) array of tile
+# exponents (as in BitGrid) and the tetrominoes as arrays of shape indexes,
+# rotations, positions and tile exponents, so that each step is a fixed number
+# of NumPy operations over all the games
+class BatchEngine:
+   # A constructor for creating n_games games on game grids with the given
+   # dimensions by using a NumPy random number generator with the given seed
+   def __init__(self, n_games, grid_h, grid_w, seed=None):
+      self.n_games = n_games
+      self.grid_height = grid_h
+      self.grid_width = grid_w
+      self.rng = np.random.default_rng(seed)
+      self.boards = np.zeros((n_games, grid_h, grid_w), dtype=np.uint8)
+      self.score = np.zeros(n_games, dtype=np.int64)
+      self.game_over = np.zeros(n_games, dtype=bool)
+      self.has_won = np.zeros(n_games, dtype=bool)
+      self.pieces_placed = np.zeros(n_games, dtype=np.int64)
+      self.rows_cleared = np.zeros(n_games, dtype=np.int64)
+      # the current tetromino of each game
+      self.shape = np.zeros(n_games, dtype=np.int64)
+      self.rotation = np.zeros(n_games, dtype=np.int64)
+      self.x = np.zeros(n_games, dtype=np.int64)
+      self.y = np.zeros(n_games, dtype=np.int64)
+      self.tiles = np.zeros((n_games, 4), dtype=np.uint8)
+      # the next tetromino of each game (its position is set when it enters)
+      self.next_shape = np.zeros(n_games, dtype=np.int64)
+      self.next_tiles = np.zeros((n_games, 4), dtype=np.uint8)
+      everyone = np.arange(n_games)
+      self.create_next(everyone)
+      self.spawn(everyone)
+      self.create_next(everyone)
+
+   # The largest tile number of each game grid
+   def max_tile(self):
+      exponents = self.boards.reshape(self.n_games, -1).max(axis=1)
+      return np.where(exponents > 0, np.left_shift(1, exponents.astype(np.int64)), 0)
+
+   # A method for creating random next tetrominoes for the given games
+   def create_next(self, games):
+      self.next_shape[games] = self.rng.integers(0, len(SHAPE_SIZES), len(games))
+      # the tiles are 2 or 4 (exponent 1 or 2)
+      self.next_tiles[games] = self.rng.integers(1, 3, (len(games), 4))
+
+   # A method for letting the next tetrominoes of the given games enter their
+   # game grids at a random horizontal position above the game grid
+   def spawn(self, games):
+      shape = self.next_shape[games]
+      self.shape[games] = shape
+      self.tiles[games] = self.next_tiles[games]
+      self.rotation[games] = 0
+      self.y[games] = self.grid_height - 1
+      self.x[games] = self.rng.integers(0, self.grid_width - SHAPE_SIZES[shape] + 1)
+      # the games in which the new tetromino overlaps the tiles are over
+      blocked = ~self.can_be_placed(games, self.rotation[games], self.x[games], self.y[games])
+      self.game_over[games[blocked]] = True
+
+   # A method for checking if the given cells (as table rows for the given
+   # games) are free on the game grids when the bottom left cells are at
+   # (x, y), where the cells outside the game grids are not checked (the
+   # bounds are checked separately)
+   def cells_free(self, games, dx, dy, valid, x, y):
+      cols = x[:, None] + dx
+      rows = y[:, None] + dy
+      inside = (valid & (rows >= 0) & (rows < self.grid_height)
+                & (cols >= 0) & (cols < self.grid_width))
+      # the cells outside the game grid are looked up at (0, 0) and ignored
+      occupied = self.boards[games[:, None], np.where(inside, rows, 0),
+                             np.where(inside, cols, 0)] != 0
+      return ~(occupied & inside).any(axis=1)
+
+   # A method that returns which of the given games can move their current
+   # tetromino by (step_x, step_y) checking only the cells in front of the
+   # leading tiles as Tetromino.can_be_moved does
+   def can_be_moved(self, games, edges, step_x, step_y):
+      shape, rotation = self.shape[games], self.rotation[games]
+      x, y = self.x[games] + step_x, self.y[games] + step_y
+      inside = ((x + MIN_COLS[shape, rotation] >= 0)
+                & (x + MAX_COLS[shape, rotation] < self.grid_width)
+                & (y + MIN_DYS[shape, rotation] >= 0))
+      dx, dy, valid = (table[shape, rotation] for table in edges)
+      return inside & self.cells_free(games, dx, dy, valid, x, y)
+
+   # A method that returns which of the given games can have their current
+   # tetromino in the given rotation states at (x, y)
+   def can_be_placed(self, games, rotation, x, y):
+      shape = self.shape[games]
+      inside = ((x + MIN_COLS[shape, rotation] >= 0)
+                & (x + MAX_COLS[shape, rotation] < self.grid_width)
+                & (y + MIN_DYS[shape, rotation] >= 0))
+      dx, dy, valid = (table[shape, rotation] for table in TILE_CELLS)
+      return inside & self.cells_free(games, dx, dy, valid, x, y)
+
+   # A method for applying one action to each game, where actions is an
+   # array of action codes (NO_ACTION for the games that are left as they are)
+   # and the games that are over are skipped. Returns a boolean array of the
+   # games in which a tetromino was locked.
+   def step(self, actions):
+      actions = np.asarray(actions)
+      playing = ~self.game_over
+      locked = np.zeros(self.n_games, dtype=bool)
+      for code, edges, step_x in ((LEFT, LEFT_EDGES, -1), (RIGHT, RIGHT_EDGES, 1)):
+         games = np.flatnonzero(playing & (actions == code))
+         if len(games):
+            moved = games[self.can_be_moved(games, edges, step_x, 0)]
+            self.x[moved] += step_x
+      games = np.flatnonzero(playing & ((actions == DOWN) | (actions == TICK)))
+      if len(games):
+         can_fall = self.can_be_moved(games, DOWN_EDGES, 0, -1)
+         self.y[games[can_fall]] -= 1
+         # the tetrominoes that cannot fall on a tick are locked
+         locked[games[~can_fall & (actions[games] == TICK)]] = True
+      games = np.flatnonzero(playing & (actions == ROTATE))
+      if len(games):
+         rotation = (self.rotation[games] + 1) % 4
+         rotated = self.can_be_placed(games, rotation, self.x[games], self.y[games])
+         self.rotation[games[rotated]] = rotation[rotated]
+      games = np.flatnonzero(playing & (actions == HARD_DROP))
+      if len(games):
+         self.hard_drop(games)
+      if locked.any():
+         self.lock(np.flatnonzero(locked))
+      return locked
+
+   # A method for dropping the current tetrominoes of the given games as far
+   # down as they can go, computed at once from the highest occupied cell
+   # below each bottommost tile (the tetromino stops as soon as one of its
+   # bottommost tiles lands on a tile or on the bottom of the game grid)
+   def hard_drop(self, games):
+      shape, rotation = self.shape[games], self.rotation[games]
+      dx, dy, valid = (table[shape, rotation] for table in DOWN_EDGES)
+      cols = np.clip(self.x[games][:, None] + dx, 0, self.grid_width - 1)
+      starts = self.y[games][:, None] + dy
+      # the columns below the bottommost tiles as (games, tiles, rows) arrays
+      columns = self.boards[games[:, None], :, cols] != 0
+      rows = np.arange(self.grid_height)
+      below = columns & (rows < starts[:, :, None])
+      highest = np.where(below, rows, -1).max(axis=2)
+      landing = np.where(valid, highest + 1 - dy, np.iinfo(np.int64).min)
+      self.y[games] = landing.max(axis=1)
+
+   # A method that turns the current tetromino of each of the given games to
+   # the given rotation state, moves it to the given x position at its
+   # current height (when it fits there), drops it and locks it onto the game
+   # grid. Returns a boolean array telling which placements were possible.
+   def place(self, games, rotation, x):
+      games = np.asarray(games)
+      games, rotation, x = (games[~self.game_over[games]],
+                            np.asarray(rotation)[~self.game_over[games]],
+                            np.asarray(x)[~self.game_over[games]])
+      possible = self.can_be_placed(games, rotation, x, self.y[games])
+      self.rotation[games[possible]] = rotation[possible]
+      self.x[games[possible]] = x[possible]
+      self.hard_drop(games)
+      self.lock(games)
+      return possible
+
+   # A method for locking the current tetrominoes of the given games onto
+   # their game grids as GameGrid.update_grid does (see settle), after which
+   # the next tetrominoes enter the game grids
+   def lock(self, games):
+      self.settle(games)
+      # create the next tetrominoes to enter the game grids
+      playing = games[~self.game_over[games]]
+      self.spawn(playing)
+      self.create_next(playing)
+
+   # A method for placing the tiles of the current tetrominoes of the given
+   # games on their game grids, merging the tiles vertically and removing the
+   # free tiles and then the full rows (without any new tetromino entering)
+   def settle(self, games):
+      shape, rotation = self.shape[games], self.rotation[games]
+      cols = self.x[games][:, None] + TILE_CELLS[0][shape, rotation]
+      rows = self.y[games][:, None] + TILE_CELLS[1][shape, rotation]
+      # a tile above the game grid ends the game
+      inside = rows < self.grid_height
+      self.game_over[games[~inside.all(axis=1)]] = True
+      owner = np.broadcast_to(games[:, None], rows.shape)
+      self.boards[owner[inside], rows[inside], cols[inside]] = self.tiles[games][inside]
+      self.pieces_placed[games] += 1
+
+      boards = self.boards[games]
+      boards, merges, score, won = merge_columns(boards)
+      self.score[games] += score
+      self.game_over[games[won]] = True
+      self.has_won[games[won]] = True
+      boards = self.remove_free_tiles(boards, games)
+      self.boards[games] = self.remove_full_rows(boards, games)
+
+   # A method that returns the features of all the game grids as a dictionary
+   # of arrays with the same names as bit_grid.board_features
+   def features(self):
+      occupied = self.boards != 0
+      # the height of a column is the row above its highest tile
+      heights = np.where(occupied.any(axis=1),
+                         self.grid_height - occupied[:, ::-1].argmax(axis=1), 0)
+      aggregate_height = heights.sum(axis=1)
+      tiles = occupied.sum(axis=(1, 2))
+      return {"aggregate_height": aggregate_height, "max_height": heights.max(axis=1),
+              "bumpiness": np.abs(np.diff(heights, axis=1)).sum(axis=1),
+              "holes": aggregate_height - tiles, "tiles": tiles}
+
+   # A method that removes the tiles that are not connected to the bottom row
+   # from the given game grids (of the given games) and adds their numbers to
+   # the scores, by a flood fill over the row bitmasks of all the grids at once
+   def remove_free_tiles(self, boards, games):
+      # only the game grids with a tile above an empty cell can have free
+      # tiles, so the flood fill is done for these game grids only
+      occupied = boards != 0
+      overhanging = np.flatnonzero((occupied[:, 1:] & ~occupied[:, :-1]).any(axis=(1, 2)))
+      if not len(overhanging):
+         return boards
+      boards[overhanging] = self.remove_unconnected_tiles(boards[overhanging],
+                                                          games[overhanging])
+      return boards
+
+   # A method that removes the tiles that are not connected to the bottom row
+   # from the given game grids as remove_free_tiles does, for all of them
+   def remove_unconnected_tiles(self, boards, games):
+      rows = row_bitmasks(boards)
+      grounded = np.zeros_like(rows)
+      grounded[:, 0] = rows[:, 0]
+      changed = True
+      while changed:
+         before = grounded.copy()
+         for row in range(1, self.grid_height):
+            seed = grounded[:, row] | (grounded[:, row - 1] & rows[:, row])
+            grounded[:, row] = fill_rows(seed, rows[:, row])
+         for row in range(self.grid_height - 2, -1, -1):
+            seed = grounded[:, row] | (grounded[:, row + 1] & rows[:, row])
+            grounded[:, row] = fill_rows(seed, rows[:, row])
+         changed = not np.array_equal(before, grounded)
+      free_rows = rows & ~grounded
+      if free_rows.any():
+         bits = np.left_shift(1, np.arange(self.grid_width), dtype=np.int64)
+         free = (free_rows[:, :, None] & bits) != 0
+         numbers = np.where(free, np.left_shift(1, boards.astype(np.int64)), 0)
+         self.score[games] += numbers.sum(axis=(1, 2))
+         boards[free] = 0
+      return boards
+
+   # A method that removes the full rows from the given game grids (of the
+   # given games) by moving the rows above them down, and adds the numbers on
+   # the removed rows to the scores
+   def remove_full_rows(self, boards, games):
+      full = (boards != 0).all(axis=2)
+      # only the game grids with a full row are changed
+      clearing = np.flatnonzero(full.any(axis=1))
+      if not len(clearing):
+         return boards
+      full, cleared, games = full[clearing], boards[clearing], games[clearing]
+      numbers = np.where(full[:, :, None], np.left_shift(1, cleared.astype(np.int64)), 0)
+      self.score[games] += numbers.sum(axis=(1, 2))
+      self.rows_cleared[games] += full.sum(axis=1)
+      # a stable sort moves the full rows to the top keeping the order of the
+      # other rows, and then the full rows are emptied
+      order = np.argsort(full, axis=1, kind='stable')
+      cleared = np.take_along_axis(cleared, order[:, :, None], axis=1)
+      cleared[np.take_along_axis(full, order, axis=1)] = 0
+      boards[clearing] = cleared
+      return boards
+
+# A function that returns the row bitmasks (bit c for an occupied column c) of
+# the given (..., grid_h, grid_w) exponent arrays
+def row_bitmasks(boards):
+   bits = np.left_shift(1, np.arange(boards.shape[-1]), dtype=np.int64)
+   return ((boards != 0) * bits).sum(axis=-1)
+
+# A function that spreads the bits of each seed horizontally within the
+# corresponding row bitmask
+def fill_rows(seed, mask):
+   seed = seed & mask
+   while True:
+      spread = (seed | (seed << 1) | (seed >> 1)) & mask
+      if np.array_equal(spread, seed):
+         return seed
+      seed = spread
@@ -0,0 +1,434 @@
+################################################################################
+#                                                                              #
+# Micro-benchmarks for the hot paths of the game engine                        #
+#                                                                              #
+# Usage: python benchmark.py [--save FILE] [--compare FILE] [--threshold 0.2]  #
+#                            [--filter TEXT] [--min-time SECONDS]              #
+#        python benchmark.py --startup [--budget SECONDS] [--runs N]           #
+#                                                                              #
+# Every benchmark uses fixed seeds and the canned boards given below, and is   #
+# reported as operations per second and the peak memory allocated by one       #
+# operation. The results can be saved as a JSON baseline and later compared    #
+# with it, where a benchmark that is slower than the baseline by more than the #
+# threshold is flagged as a regression (and the exit status is 1). Some        #
+# benchmarks are also checked against each other in every run (see RELATIONS), #
+# such as BitGrid against GameGrid.                                            #
+#                                                                              #
+# With --startup, the game is started in new processes instead (without a      #
+# display or audio device) and the time taken to import it and the time until  #
+# its first frame is shown are reported, where a first frame later than the    #
+# budget is flagged (and the exit status is 1).                                #
+#                                                                              #
+################################################################################
+
+import argparse  # for parsing the command line arguments
+import gc  # the garbage collector is turned off while timing
+import json  # the baselines are saved as JSON
+import os  # used for the environment of the startup processes
+import platform  # the version of Python is saved with the baselines
+import random  # used for the actions of the headless games
+import statistics  # used for the median of the startup times
+import subprocess  # the startup is timed in new processes
+import sys
+import time  # the monotonic clock used for timing the operations
+import tracemalloc  # used for measuring the memory allocated by the operations
+import numpy as np  # the fundamental Python module for scientific computing
+from game_grid import GameGrid  # the class for modeling the game grid
+from bit_grid import BitGrid  # the headless game grid
+from tetromino import Tetromino  # the class for modeling the tetrominoes
+from engine import GameEngine, ACTIONS, HARD_DROP, TICK  # the rules of the game
+from tile import Tile  # used for the tiles of the canned boards
+from point import Point  # used for the positions of the tetrominoes
+
+# the default file of the baseline and the default regression threshold (the
+# fraction of the operations per second of the baseline that can be lost)
+BASELINE_FILE = "benchmark_baseline.json"
+THRESHOLD = 0.2
+# the number of processes started and the most time (in seconds) from the
+# start of a process until the first frame of the game is shown
+STARTUP_RUNS = 5
+STARTUP_BUDGET = 1.0
+# the relations between the benchmarks checked after every run, as (name,
+# other name, least ratio) tuples: the first benchmark has to run at least the
+# given fraction of the operations per second of the other one
+RELATIONS = [
+   # the headless game grid is meant to be the fast one (the games are the
+   # same, so this compares the cost of a lock on both game grids)
+   ("game (BitGrid, random actions)", "game (GameGrid, random actions)", 1.0),
+   # placing the tiles of a tetromino costs the same however full the game
+   # grid is (up to the regression threshold)
+   ("grid.lock_tiles (no merges, 16 rows)", "grid.lock_tiles (no merges, 2 rows)",
+    1 - THRESHOLD),
+   ("bitgrid.lock_tiles (no merges, 16 rows)", "bitgrid.lock_tiles (no merges, 2 rows)",
+    1 - THRESHOLD),
+]
+
+# the program run by each startup process: it imports the game and starts it
+# until the first frame is shown, and prints the times from the start of the
+# process (given by the parent process as the time since the epoch) as JSON
+STARTUP_PROGRAM = """
+import json, os, sys, time
+started = float(os.environ["T2K_STARTED"])
+imported_start = time.time()
+import Tetris_2048
+import lib.stddraw as stddraw
+imported = time.time()
+
+def first_frame(*args):
+   now = time.time()
+   print(json.dumps({"interpreter": imported_start - started,
+                     "import": imported - imported_start, "first_frame": now - started}))
+   sys.exit(0)
+
+stddraw.show = first_frame
+Tetris_2048.start()
+"""
+
+# the canned boards, drawn as the bottom rows of a 20 x 12 game grid where each
+# character is the exponent of the number on a tile (1 for 2, ..., b for 2048)
+# and '.' is an empty cell
+BOARDS = {
+   # an uneven stack with no merges, free tiles or full rows pending
+   "stacked": ["...2.....1..",
+               "2..1.2...2.1",
+               "13.2.1..13.2",
+               "2413.23.3131",
+               "132424121.42"],
+   # columns with runs of equal tiles, which merge in chains
+   "merges": ["1.....3.....",
+              "1..2..3...1.",
+              "2..2..4..21.",
+              "3..3..5.121.",
+              "4.1412341212"],
+   # columns with empty cells under the tiles (for gravity)
+   "gaps": ["12.3.4..21..",
+            "............",
+            "3.1..2.1..3.",
+            "....1.......",
+            "213.2.3.1232"],
+   # tiles that are not connected to the bottom row
+   "free": ["..21....3...",
+            "........12..",
+            "..1.........",
+            "3.....2.....",
+            "1212.3.21.13"],
+   # two full rows under a few more tiles
+   "full_rows": ["..1...2.....",
+                 "2121.213.121",
+                 "343434343434",
+                 "121212121212"],
+   # boards with no equal tiles on top of each other, no free tiles or
+   # overhangs and no full rows (the last column is empty), filled up to the
+   # 2nd and the 16th row
+   "low_fill": ["23456123456.",
+                "12345612345."],
+   "high_fill": ["45612345612.",
+                 "34561234561.",
+                 "23456123456.",
+                 "12345612345.",
+                 "61234561234.",
+                 "56123456123.",
+                 "45612345612.",
+                 "34561234561.",
+                 "23456123456.",
+                 "12345612345.",
+                 "61234561234.",
+                 "56123456123.",
+                 "45612345612.",
+                 "34561234561.",
+                 "23456123456.",
+                 "12345612345."],
+}
+GRID_H, GRID_W = 20, 12
+
+# A function that returns a game grid (a GameGrid unless another class is
+# given) with the tiles of the canned board with the given name
+def make_grid(name, grid_class=GameGrid):
+   grid = grid_class(GRID_H, GRID_W)
+   exponents = np.zeros((GRID_H, GRID_W), dtype=np.uint8)
+   for i, line in enumerate(BOARDS[name]):
+      row = len(BOARDS[name]) - 1 - i
+      for col, char in enumerate(line):
+         if char != '.':
+            exponents[row, col] = int(char, 16)
+   if grid_class is BitGrid:
+      grid.exponents = exponents
+   else:
+      for row, col in zip(*exponents.nonzero()):
+         grid.tile_matrix[row][col] = Tile(1 << int(exponents[row, col]))
+   grid.sync_row_bits()
+   return grid
+
+# A function that returns a tetromino of the given shape with fixed tile
+# numbers at the given position
+def make_tetromino(shape, x, y):
+   tetromino = Tetromino(shape, GRID_H, GRID_W, random.Random(0))
+   tetromino.bottom_left_cell = Point(x, y)
+   return tetromino
+
+# A function that plays a headless game on a game grid of the given class to
+# the end with random actions (with fixed seeds)
+def play_game(grid_class):
+   engine = GameEngine(grid_class(GRID_H, GRID_W), 2048)
+   rng = random.Random(2048)
+   while not engine.game_over:
+      engine.step(rng.choice(ACTIONS))
+   return engine
+
+# A function that returns a setup for the engine.lock benchmarks: it gives a
+# new game engine (with a game grid of the given class) in which the given
+# number of tetrominoes have been locked with random actions (with fixed
+# seeds), and whose current tetromino has been dropped so that it is locked by
+# the next tick
+def lock_engine_setup(grid_class, pieces):
+   engine = GameEngine(grid_class(GRID_H, GRID_W), 2048)
+   rng = random.Random(pieces)
+   while engine.pieces_placed < pieces and not engine.game_over:
+      engine.step(rng.choice(ACTIONS))
+   engine.step(HARD_DROP)
+   state = engine.snapshot()
+
+   def setup():
+      engine.restore(state)
+      return engine
+   return setup
+
+# The benchmarks as (name, setup, operation, argument) tuples: the setup (not
+# timed) returns a new argument for each run of the operation, and when it is
+# None the operation is run again and again on the given argument
+def benchmarks():
+   grid = make_grid("stacked")
+   tetromino = make_tetromino('T', 4, 12)
+
+   def move(tetromino):
+      tetromino.move("left", grid)
+      tetromino.move("right", grid)
+
+   # the tiles of an L tetromino dropped onto the stacked board and a new game
+   # grid (of the given class) to lock them onto
+   def lock_setup(grid_class=GameGrid):
+      locked = make_tetromino('L', 6, 12)
+      locked.hard_drop(grid)
+      return make_grid("stacked", grid_class), locked.get_min_bounded_tile_matrix(True)
+
+   # a setup for the lock_tiles benchmarks: it gives a game grid (of the given
+   # class) with the tiles of the board with the given name and the tiles of
+   # an O tetromino (with numbers that are not on the boards, so that nothing
+   # merges) dropped onto it, where the same game grid is used for every run
+   # (the tiles placed by the last run are taken off), as a new game grid for
+   # each run would leave the caches of the processor colder for a fuller board
+   def place_setup(name, grid_class=GameGrid):
+      grid = make_grid(name, grid_class)
+      placed = Tetromino.from_state(('O', 0, 4, GRID_H - 1, (128, 256, 512, 1024)),
+                                    GRID_H, GRID_W)
+      placed.hard_drop(grid)
+      tile_cells = placed.get_tile_cells()
+
+      def setup():
+         for tile, (row, col) in tile_cells:
+            if grid_class is GameGrid:
+               grid.tile_matrix[row][col] = None
+            grid.exponents[row, col] = 0
+         grid.sync_row_bits()
+         grid.handle_free_tiles()  # the support of the cells as after a lock
+         return grid, tile_cells
+      return setup
+
+   return [
+      ("tetromino.move (left + right)", None, move, tetromino),
+      ("tetromino.rotate", None, lambda t: t.rotate(grid), tetromino),
+      ("tetromino.hard_drop", lambda: make_tetromino('I', 3, GRID_H - 1),
+       lambda t: t.hard_drop(grid), None),
+      ("tetromino.get_min_bounded_tile_matrix", None,
+       lambda t: t.get_min_bounded_tile_matrix(True), tetromino),
+      ("grid.update_grid", lock_setup, lambda args: args[0].update_grid(*args[1]), None),
+      # only the placement of the tiles (with no merges, free tiles or full
+      # rows), whose cost should not depend on how full the game grid is
+      ("grid.lock_tiles (no merges, 2 rows)", place_setup("low_fill"),
+       lambda args: args[0].lock_tiles(args[1]), None),
+      ("grid.lock_tiles (no merges, 16 rows)", place_setup("high_fill"),
+       lambda args: args[0].lock_tiles(args[1]), None),
+      # whole locks in the game engine, with the merges, the free tiles and
+      # the full rows of the games (more of them later in the game)
+      ("engine.lock (GameGrid, piece 1)", lock_engine_setup(GameGrid, 0),
+       lambda e: e.step(TICK), None),
+      ("engine.lock (GameGrid, piece 40)", lock_engine_setup(GameGrid, 39),
+       lambda e: e.step(TICK), None),
+      ("grid.merge_vertical_tiles", lambda: make_grid("merges"),
+       lambda g: g.merge_vertical_tiles(), None),
+      ("grid.apply_gravity", lambda: make_grid("gaps"), lambda g: g.apply_gravity(), None),
+      ("grid.handle_free_tiles", lambda: make_grid("free"),
+       lambda g: g.handle_free_tiles(), None),
+      ("grid.remove_full_rows", lambda: make_grid("full_rows"),
+       lambda g: g.remove_full_rows(), None),
+      ("bitgrid.update_grid", lambda: lock_setup(BitGrid),
+       lambda args: args[0].update_grid(*args[1]), None),
+      ("bitgrid.lock_tiles (no merges, 2 rows)", place_setup("low_fill", BitGrid),
+       lambda args: args[0].lock_tiles(args[1]), None),
+      ("bitgrid.lock_tiles (no merges, 16 rows)", place_setup("high_fill", BitGrid),
+       lambda args: args[0].lock_tiles(args[1]), None),
+      ("engine.lock (BitGrid, piece 1)", lock_engine_setup(BitGrid, 0),
+       lambda e: e.step(TICK), None),
+      ("engine.lock (BitGrid, piece 40)", lock_engine_setup(BitGrid, 39),
+       lambda e: e.step(TICK), None),
+      ("game (GameGrid, random actions)", None, lambda c: play_game(c), GameGrid),
+      ("game (BitGrid, random actions)", None, lambda c: play_game(c), BitGrid),
+   ]
+
+# A function that runs one benchmark for at least min_time seconds (in the
+# best of the given number of rounds) and returns its operations per second,
+# where the garbage collector is turned off as in the timeit module so that
+# the garbage of the setup is not collected while an operation is timed
+def time_operation(setup, operation, argument, min_time, rounds=5):
+   best = 0.0
+   for i in range(rounds):
+      gc.collect()
+      gc.disable()
+      elapsed, count = 0.0, 0
+      while elapsed < min_time / rounds:
+         if setup is None:
+            start = time.perf_counter()
+            operation(argument)
+            elapsed += time.perf_counter() - start
+         else:
+            value = setup()
+            start = time.perf_counter()
+            operation(value)
+            elapsed += time.perf_counter() - start
+         count += 1
+      gc.enable()
+      best = max(best, count / elapsed)
+   return best
+
+# A function that returns the average peak of the memory allocated by one
+# operation (in bytes) over the given number of operations
+def peak_allocation(setup, operation, argument, count=20):
+   total = 0
+   tracemalloc.start()
+   for i in range(count):
+      value = argument if setup is None else setup()
+      tracemalloc.reset_peak()
+      before = tracemalloc.get_traced_memory()[0]
+      operation(value)
+      total += tracemalloc.get_traced_memory()[1] - before
+   tracemalloc.stop()
+   return total // count
+
+# A function that runs the benchmarks whose names contain the given text and
+# returns their results as a dictionary {name: {"ops_per_sec", "peak_bytes"}}
+def run(text="", min_time=0.5):
+   results = {}
+   for name, setup, operation, argument in benchmarks():
+      if text not in name:
+         continue
+      ops = time_operation(setup, operation, argument, min_time)
+      peak = peak_allocation(setup, operation, argument, 3 if name.startswith("game") else 20)
+      results[name] = {"ops_per_sec": ops, "peak_bytes": peak}
+      print("%-42s %14.1f ops/s %10d B peak" % (name, ops, peak))
+   return results
+
+# A function that starts the game in the given number of new processes (with
+# no display or audio device) and returns the times of each start as a list of
+# dictionaries {"interpreter", "import", "first_frame"} in seconds
+def measure_startup(runs=STARTUP_RUNS):
+   directory = os.path.dirname(os.path.realpath(__file__))
+   environment = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy")
+   times = []
+   for i in range(runs):
+      environment["T2K_STARTED"] = repr(time.time())
+      output = subprocess.run([sys.executable, "-c", STARTUP_PROGRAM], cwd=directory,
+                              env=environment, capture_output=True, text=True,
+                              check=True).stdout
+      times.append(json.loads(output.splitlines()[-1]))
+   return times
+
+# A function that reports the median startup times over the given number of
+# runs and returns True when the first frame is shown within the budget
+def startup(runs=STARTUP_RUNS, budget=STARTUP_BUDGET):
+   times = measure_startup(runs)
+   for name in ("interpreter", "import", "first_frame"):
+      print("%-42s %10.1f ms (median of %d)"
+            % ("startup: " + name, 1000 * statistics.median(t[name] for t in times), runs))
+   first_frame = statistics.median(t["first_frame"] for t in times)
+   if first_frame > budget:
+      print("%-42s %10.1f ms over the budget of %.1f ms"
+            % ("startup: first_frame", 1000 * (first_frame - budget), 1000 * budget))
+      return False
+   return True
+
+# A function that checks the relations between the given results (see
+# RELATIONS, only the ones with both benchmarks in the results) and returns
+# the names of the benchmarks that are too slow
+def check_relations(results, relations=RELATIONS):
+   failures = []
+   relations = [relation for relation in relations
+                if relation[0] in results and relation[1] in results]
+   if relations:
+      print()
+   for name, other, least in relations:
+      ratio = results[name]["ops_per_sec"] / results[other]["ops_per_sec"]
+      flag = ""
+      if ratio < least:
+         flag = "TOO SLOW"
+         failures.append(name)
+      print("%-42s %6.2fx of %s (at least %.2fx) %s" % (name, ratio, other, least, flag))
+   return failures
+
+# A function that compares the given results with the given baseline and
+# returns the names of the benchmarks that are slower than the baseline by
+# more than the threshold (the benchmarks missing from the baseline are only
+# reported)
+def compare(results, baseline, threshold=THRESHOLD):
+   regressions = []
+   for name, result in results.items():
+      if name not in baseline:
+         print("%-42s %7s no baseline" % (name, ""))
+         continue
+      ratio = result["ops_per_sec"] / baseline[name]["ops_per_sec"]
+      flag = ""
+      if ratio < 1 - threshold:
+         flag = "REGRESSION"
+         regressions.append(name)
+      print("%-42s %6.2fx %s" % (name, ratio, flag))
+   return regressions
+
+# The main function where this program starts execution
+def main(argv=None):
+   parser = argparse.ArgumentParser(description="Benchmark the game engine.")
+   parser.add_argument("--save", metavar="FILE", nargs="?", const=BASELINE_FILE,
+                       help="save the results as a baseline (default: %s)" % BASELINE_FILE)
+   parser.add_argument("--compare", metavar="FILE", nargs="?", const=BASELINE_FILE,
+                       help="compare the results with a baseline")
+   parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                       help="the fraction of the speed that can be lost (default: %s)"
+                            % THRESHOLD)
+   parser.add_argument("--filter", default="", help="run only the matching benchmarks")
+   parser.add_argument("--min-time", type=float, default=0.5,
+                       help="the time spent on each benchmark in seconds")
+   parser.add_argument("--startup", action="store_true",
+                       help="time the startup of the game instead")
+   parser.add_argument("--budget", type=float, default=STARTUP_BUDGET,
+                       help="the most seconds until the first frame (default: %s)"
+                            % STARTUP_BUDGET)
+   parser.add_argument("--runs", type=int, default=STARTUP_RUNS,
+                       help="the number of times the game is started")
+   args = parser.parse_args(argv)
+
+   if args.startup:
+      return 0 if startup(args.runs, args.budget) else 1
+   results = run(args.filter, args.min_time)
+   if args.save:
+      with open(args.save, "w") as file:
+         json.dump({"python": platform.python_version(), "results": results},
+                   file, indent=2, sort_keys=True)
+         file.write("\n")
+   failed = bool(check_relations(results))
+   if args.compare:
+      with open(args.compare) as file:
+         baseline = json.load(file)["results"]
+      print()
+      failed = bool(compare(results, baseline, args.threshold)) or failed
+   return 1 if failed else 0
+
+if __name__ == '__main__':
+   sys.exit(main())
@@ -0,0 +1,501 @@
+import numpy as np
+from collections import namedtuple
+from tile import Tile
+
+# An immutable snapshot of the tiles (as the bytes of the exponent array and the
+# row bitmasks) and the score and flags of a game grid (see BitGrid.snapshot
+# and GameGrid.snapshot)
+GridState = namedtuple('GridState', ['exponents', 'row_bits', 'score', 'game_over', 'has_won'])
+
+# A grid engine with the same rules as GameGrid that stores the occupancy of
+# each row as an integer bitmask (bit c set when column c is occupied) and the
+# tile numbers as a compact array of exponents (2 -> 1, 4 -> 2, ..., 2048 -> 11,
+# 0 for an empty cell). Tile objects are only created when the grid is drawn.
+class BitGrid:
+    def __init__(self, grid_h, grid_w):
+        self.grid_height = grid_h
+        self.grid_width = grid_w
+        self.full_row = (1 << grid_w) - 1
+        self.row_bits = [0] * grid_h
+        self.exponents = np.zeros((grid_h, grid_w), dtype=np.uint8)
+        self.current_tetromino = None
+        self.next_tetromino = None
+        self.game_over = False
+        self.has_won = False
+        self.score = 0
+        self.cleared_rows = []
+        # the cells connected to the bottom row through the rows below them
+        # (valid below dirty_row) and the rows with cells connected to the
+        # bottom row only through the rows above them, kept between the calls
+        # of handle_free_tiles so that only the changed rows are examined
+        self.support = [0] * grid_h
+        self.overhang_rows = []
+        self.dirty_row = 0
+        # the cells locked since the merges were last resolved, next to which
+        # two equal tiles may be on top of each other (None when there may be
+        # such tiles anywhere)
+        self.merge_candidates = None
+        # the heights of the columns for the row bitmasks in heights_rows
+        self.heights_rows = None
+        self.heights = None
+
+    @classmethod
+    def from_tile_matrix(cls, tile_matrix):
+        grid_h, grid_w = tile_matrix.shape
+        grid = cls(grid_h, grid_w)
+        for row in range(grid_h):
+            for col in range(grid_w):
+                tile = tile_matrix[row][col]
+                if tile is not None:
+                    grid.exponents[row, col] = tile.number.bit_length() - 1
+        grid.sync_row_bits()
+        return grid
+
+    def get_tile_matrix(self):
+        tile_matrix = np.full((self.grid_height, self.grid_width), None)
+        for row in range(self.grid_height):
+            bits = self.row_bits[row]
+            while bits:
+                col = (bits & -bits).bit_length() - 1
+                bits &= bits - 1
+                tile_matrix[row][col] = Tile(1 << int(self.exponents[row, col]))
+        return tile_matrix
+
+    def get_exponents(self):
+        # the tile numbers as exponents of 2 (0 for an empty cell)
+        return self.exponents.copy()
+
+    def snapshot(self):
+        return GridState(self.exponents.tobytes(), tuple(self.row_bits), self.score,
+                         self.game_over, self.has_won)
+
+    def restore(self, state):
+        self.exponents = np.frombuffer(state.exponents, dtype=np.uint8).reshape(
+            self.grid_height, self.grid_width).copy()
+        self.score, self.game_over, self.has_won = state.score, state.game_over, state.has_won
+        self.cleared_rows = []
+        self.row_bits = list(state.row_bits)
+        self.merge_candidates = None
+        # the support of the cells is found again from the bottom row
+        self.support = [0] * self.grid_height
+        _sweep_up(self.row_bits, self.support, 0)
+        self.overhang_rows = [row for row in range(self.grid_height)
+                              if self.row_bits[row] & ~self.support[row]]
+        self.dirty_row = self.grid_height
+
+    def sync_row_bits(self):
+        # rebuild the row bitmasks from the exponent array (one packbits call)
+        packed = np.packbits(self.exponents != 0, axis=1, bitorder='little')
+        row_bits = [int.from_bytes(row.tobytes(), 'little') for row in packed]
+        for row in range(min(self.dirty_row, self.grid_height)):
+            if row_bits[row] != self.row_bits[row]:
+                self.dirty_row = row
+                break
+        self.row_bits = row_bits
+        self.merge_candidates = None
+
+    def is_occupied(self, row, col):
+        return self.is_inside(row, col) and (self.row_bits[row] >> col) & 1 == 1
+
+    def is_inside(self, row, col):
+        return 0 <= row < self.grid_height and 0 <= col < self.grid_width
+
+    def get_column_heights(self):
+        # the heights are kept until the row bitmasks change
+        rows = tuple(self.row_bits)
+        if rows != self.heights_rows:
+            self.heights_rows = rows
+            self.heights = column_heights(rows, self.grid_width)
+        return self.heights
+
+    def get_row_counts(self):
+        return [bin(bits).count("1") for bits in self.row_bits]
+
+    def get_features(self):
+        # the features of the board (see board_features)
+        return board_features(self.get_column_heights(), self.get_row_counts())
+
+    def get_landing_row(self, state, x, y):
+        # the row to which a tetromino in the given rotation state drops from
+        # (x, y) (see landing_row)
+        return landing_row(self.row_bits, self.get_column_heights(), state.down_edges, x, y)
+
+    def is_full(self, row):
+        return self.row_bits[row] == self.full_row
+
+    def remove_full_rows(self):
+        full_rows = [row for row in range(self.grid_height) if self.row_bits[row] == self.full_row]
+        # the same top-down order in which GameGrid reports the cleared rows
+        self.cleared_rows = full_rows[::-1]
+        if full_rows:
+            self.score += int((np.left_shift(1, self.exponents[full_rows].astype(np.int64))).sum())
+            kept = [row for row in range(self.grid_height) if self.row_bits[row] != self.full_row]
+            self.exponents[:len(kept)] = self.exponents[kept]
+            self.exponents[len(kept):] = 0
+            self.row_bits = [self.row_bits[row] for row in kept] + [0] * len(full_rows)
+            self.dirty_row = min(self.dirty_row, full_rows[0])
+            self.merge_candidates = None
+        return len(full_rows)
+
+    def update_grid(self, tiles_to_lock, blc_position):
+        self.current_tetromino = None
+        n_rows, n_cols = len(tiles_to_lock), len(tiles_to_lock[0])
+        cells = []
+        for row in range(n_rows):
+            for col in range(n_cols):
+                tile = tiles_to_lock[row][col]
+                if tile:
+                    cells.append((blc_position.y + (n_rows - 1 - row), blc_position.x + col,
+                                  tile.number.bit_length() - 1))
+        return self.lock_cells(cells)
+
+    def lock_tiles(self, tile_cells):
+        # tile_cells is a list of (tile, (row, col)) as from Tetromino.get_tile_cells
+        return self.lock_cells([(row, col, tile.number.bit_length() - 1)
+                                for tile, (row, col) in tile_cells])
+
+    def lock_cells(self, cells):
+        # cells is an iterable of (row, col, exponent) triples
+        self.current_tetromino = None
+        for row, col, exponent in cells:
+            if self.is_inside(row, col):
+                self.exponents[row, col] = exponent
+                self.row_bits[row] |= 1 << col
+                self.dirty_row = min(self.dirty_row, row)
+                if self.merge_candidates is not None:
+                    self.merge_candidates.append((row, col))
+            else:
+                self.game_over = True
+
+        self.merge_vertical_tiles()
+        self.handle_free_tiles()
+        self.remove_full_rows()
+        return self.game_over
+
+    def merge_vertical_tiles(self):
+        # after most locks no tile is on top of an equal tile, and then the
+        # lock is done with the row bitmasks alone (see has_vertical_pair)
+        candidates, self.merge_candidates = self.merge_candidates, []
+        if not has_vertical_pair(self.exponents, candidates):
+            return 0
+        # the columns that change are merged one at a time (see merge_grid),
+        # as the NumPy passes of merge_columns cost more for one game grid
+        merges, score, won, changes = merge_grid(self.exponents, self.get_column_heights())
+        self.sync_row_bits()
+        self.merge_candidates = []  # all the merges have been resolved
+        self.score += score
+        if won:
+            self.game_over = True
+            self.has_won = True
+        return merges
+
+    def apply_gravity(self):
+        self.exponents = _compact_columns(self.exponents)
+        self.sync_row_bits()  # the tiles may now be on top of equal tiles
+
+    def handle_free_tiles(self):
+        # only the rows from the lowest changed row up are examined again
+        # (see find_free_cells)
+        free_cells, self.overhang_rows = find_free_cells(
+            self.row_bits, self.support, self.overhang_rows, self.dirty_row)
+        self.dirty_row = self.grid_height
+        removed = 0
+        for row, free in free_cells:
+            self.row_bits[row] &= ~free
+            while free:
+                col = (free & -free).bit_length() - 1
+                free &= free - 1
+                self.score += 1 << int(self.exponents[row, col])
+                self.exponents[row, col] = 0
+                removed += 1
+        return removed
+
+
+# Resolves the vertical merges of the tiles in the exponent array of one or more
+# game grids (with shape (..., grid_h, grid_w)) the same way as the repeated
+# passes of GameGrid.merge_vertical_tiles, but with every pass done for all
+# columns (and all grids) at once. Returns the merged exponents together with
+# the number of merges, the score gained and whether a 2048 tile was made for
+# each grid.
+def merge_columns(exponents):
+    merged = exponents.copy()
+    lead_shape = exponents.shape[:-2]
+    grid_h, grid_w = exponents.shape[-2:]
+    grids = merged.reshape(-1, grid_h, grid_w)
+    merges = np.zeros(len(grids), dtype=np.int64)
+    score = np.zeros(len(grids), dtype=np.int64)
+    won = np.zeros(len(grids), dtype=bool)
+    index = np.arange(grid_h - 1, dtype=np.int16)
+    # the columns that may merge (as grid and column indexes), which are only
+    # the columns with two equal tiles on top of each other at first
+    equal = grids[:, :-1] == grids[:, 1:]
+    equal &= grids[:, :-1] != 0
+    grid_index, col_index = np.nonzero(equal.any(axis=1))
+    while len(grid_index):
+        cells = grids[grid_index, :, col_index]
+        equal = (cells[:, :-1] == cells[:, 1:]) & (cells[:, :-1] != 0)
+        has_pair = equal.any(axis=1)
+        if not has_pair.all():
+            grid_index, col_index = grid_index[has_pair], col_index[has_pair]
+            cells, equal = cells[has_pair], equal[has_pair]
+            if not len(grid_index):
+                break
+        # in a run of equal tiles a pass merges the 1st and 2nd tiles, the 3rd
+        # and 4th tiles and so on, so a merge starts where the distance to the
+        # last unequal pair below is odd
+        last_unequal = np.maximum.accumulate(np.where(equal, np.int16(-1), index), axis=1)
+        starts = equal & ((index - last_unequal) & 1 == 1)
+        cells[:, :-1] += starts
+        cells[:, 1:][starts] = 0
+        grids[grid_index, :, col_index] = cells
+        new_exponents = np.where(starts, cells[:, :-1], 0)
+        merges += np.bincount(grid_index, starts.sum(axis=1), len(grids)).astype(np.int64)
+        score += np.bincount(grid_index, _POWERS_OF_TWO[new_exponents].sum(axis=1),
+                             len(grids)).astype(np.int64)
+        won[grid_index[(new_exponents == 11).any(axis=1)]] = True
+        # gravity is applied to every column of a grid in which a merge
+        # happened, and then all these columns are checked again
+        merging = np.unique(grid_index)
+        grids[merging] = _compact_columns(grids[merging])
+        grid_index = np.repeat(merging, grid_w)
+        col_index = np.tile(np.arange(grid_w), len(merging))
+    return merged, merges.reshape(lead_shape), score.reshape(lead_shape), won.reshape(lead_shape)
+
+
+# Returns True when there are two equal tiles on top of each other in the
+# exponent array of a game grid, looking only at the tiles in the given
+# (row, col) cells and the tiles on top of and under them (at all the tiles
+# when cells is None), so that the merges can be skipped without any work on
+# the whole array after most locks
+def has_vertical_pair(exponents, cells=None):
+    if cells is None:
+        return bool(((exponents[:-1] == exponents[1:]) & (exponents[:-1] != 0)).any())
+    grid_h = len(exponents)
+    for row, col in cells:
+        exponent = exponents[row, col]
+        if exponent and ((row > 0 and exponents[row - 1, col] == exponent) or
+                         (row < grid_h - 1 and exponents[row + 1, col] == exponent)):
+            return True
+    return False
+
+
+# Resolves the vertical merges of one column of a game grid, given as a list of
+# the tile exponents from the bottom up (0 for an empty cell), which is changed
+# in place. In each pass, the 1st and 2nd tiles of a run of equal tiles merge,
+# the 3rd and 4th tiles and so on, where the lower tile of each pair takes the
+# sum and the upper one is removed, and then the tiles fall to the bottom of
+# the column. The first pass and the fall after it are always done (as a merge
+# somewhere on the game grid makes every column fall, see merge_grid) and the
+# passes go on until one has no merge. Returns the number of merges, the score
+# gained, whether a 2048 tile was made, the row in the given column of the
+# tile on each row (None for an empty cell) and the set of the rows of the
+# lower tiles that have been merged (in the given column too).
+def merge_column(column):
+    origins = list(range(len(column)))
+    merged = set()
+    merges, score, won = 0, 0, False
+    first_pass = True
+    while True:
+        row, top, pass_merges = 0, len(column) - 1, 0
+        while row < top:
+            exponent = column[row]
+            if exponent and exponent == column[row + 1]:
+                exponent += 1
+                column[row], column[row + 1] = exponent, 0
+                merged.add(origins[row])
+                pass_merges += 1
+                score += 1 << exponent
+                won = won or exponent == 11
+                # the upper tile is gone, so the next pair starts above it
+                row += 2
+                continue
+            row += 1
+        if not pass_merges and not first_pass:
+            break
+        merges += pass_merges
+        first_pass = False
+        tiles = [(exponent, origin) for exponent, origin in zip(column, origins) if exponent]
+        empty = len(column) - len(tiles)
+        column[:] = [exponent for exponent, origin in tiles] + [0] * empty
+        origins = [origin for exponent, origin in tiles] + [None] * empty
+    return merges, score, won, origins, merged
+
+
+# Resolves the vertical merges of the tiles in the exponent array of one game
+# grid in place, given the height of each column, the same way as
+# merge_columns but one column at a time with merge_column, and only for the
+# columns that change: the ones with two equal tiles on top of each other or
+# with an empty cell under a tile. This is meant for a game grid with two
+# equal tiles on top of each other (see has_vertical_pair). Returns the number
+# of merges, the score gained, whether a 2048 tile was made and a list of
+# (col, origins, merged) for the changed columns (see merge_column), so that
+# the tiles of a GameGrid can follow their exponents.
+def merge_grid(exponents, heights):
+    occupied = exponents != 0
+    changing = (((exponents[:-1] == exponents[1:]) & occupied[:-1]) |
+                (occupied[1:] & ~occupied[:-1])).any(axis=0)
+    merges, score, won = 0, 0, False
+    changes = []
+    for col in np.flatnonzero(changing).tolist():
+        height = heights[col]
+        column = exponents[:height, col].tolist()
+        column_merges, column_score, column_won, origins, merged = merge_column(column)
+        exponents[:height, col] = column
+        merges += column_merges
+        score += column_score
+        won = won or column_won
+        changes.append((col, origins, merged))
+    return merges, score, won, changes
+
+
+# 2 to the power of each exponent (0 for the exponent of an empty cell)
+_POWERS_OF_TWO = np.array([0] + [1 << exponent for exponent in range(1, 63)], dtype=np.int64)
+
+
+# Moves the tiles of every column down so that the empty cells are on top
+# (only the columns with an empty cell below a tile are sorted)
+def _compact_columns(exponents):
+    empty = exponents == 0
+    gaps = (empty[..., :-1, :] & ~empty[..., 1:, :]).any(axis=-2)
+    if not gaps.any():
+        return exponents
+    columns = np.moveaxis(exponents, -2, -1)[gaps]
+    order = np.argsort(columns == 0, axis=-1, kind='stable')
+    exponents = exponents.copy()
+    np.moveaxis(exponents, -2, -1)[gaps] = np.take_along_axis(columns, order, axis=-1)
+    return exponents
+
+
+# Returns the height of each column (the row above its highest tile, 0 for an
+# empty column) from the row bitmasks, going down from the top row until
+# every column has been seen
+def column_heights(row_bits, grid_w):
+    heights = [0] * grid_w
+    full_row = (1 << grid_w) - 1
+    seen = 0
+    for row in range(len(row_bits) - 1, -1, -1):
+        new = row_bits[row] & ~seen
+        while new:
+            col = (new & -new).bit_length() - 1
+            new &= new - 1
+            heights[col] = row + 1
+        seen |= row_bits[row]
+        if seen == full_row:
+            break
+    return heights
+
+
+# Returns the features of a board used for analysing the games, from the
+# height of each column and the number of tiles on each row: the sum and the
+# largest of the heights, the bumpiness (the sum of the height differences of
+# neighbouring columns), the holes (the empty cells under the top of their
+# column) and the number of tiles
+def board_features(heights, row_counts):
+    tiles = sum(row_counts)
+    return {
+        "aggregate_height": sum(heights),
+        "max_height": max(heights),
+        "bumpiness": sum(abs(a - b) for a, b in zip(heights, heights[1:])),
+        "holes": sum(heights) - tiles,
+        "tiles": tiles,
+    }
+
+
+# Returns the row to which a tetromino drops from (x, y) (the position of its
+# bottom left cell), given the bottommost tile of each of its columns as
+# (dy, mask) row bitmasks (see RotationState.down_edges). Each column needs a
+# scan only when the tile is below the surface of the column (under a tile
+# that sticks out), otherwise the height of the column is used.
+def landing_row(row_bits, heights, down_edges, x, y):
+    landing = None
+    for dy, mask in down_edges:
+        row = y + dy
+        mask = mask << x if x >= 0 else mask >> -x
+        while mask:
+            col = (mask & -mask).bit_length() - 1
+            mask &= mask - 1
+            floor = heights[col]
+            if floor > row:
+                # the highest tile below the tile of the tetromino
+                floor = 0
+                for below in range(min(row, len(row_bits)) - 1, -1, -1):
+                    if (row_bits[below] >> col) & 1:
+                        floor = below + 1
+                        break
+            if landing is None or floor - dy > landing:
+                landing = floor - dy
+    return landing
+
+
+# Returns the bitmasks of the cells of each row that are connected to the
+# bottom row through the occupied cells given by the row bitmasks. The flood
+# fill propagates up and down with shifts and ANDs until nothing changes,
+# starting from the given masks of cells that are known to be connected.
+def grounded_rows(row_bits, grounded=None):
+    grid_h = len(row_bits)
+    if grounded is None:
+        grounded = [0] * grid_h
+        _sweep_up(row_bits, grounded, 0)
+    else:
+        grounded = list(grounded)
+    changed = True
+    while changed:
+        changed = False
+        for row in range(grid_h - 2, -1, -1):
+            seed = grounded[row + 1] & row_bits[row] & ~grounded[row]
+            if seed:
+                grounded[row] = _fill_row(grounded[row] | seed, row_bits[row])
+                changed = True
+        for row in range(1, grid_h):
+            seed = grounded[row - 1] & row_bits[row] & ~grounded[row]
+            if seed:
+                grounded[row] = _fill_row(grounded[row] | seed, row_bits[row])
+                changed = True
+    return grounded
+
+
+# Finds the cells that are not connected to the bottom row, given the row
+# bitmasks, the support of the cells (the cells connected to the bottom row
+# through the rows below them, updated here) and the rows with cells
+# connected to the bottom row only through the rows above them, both kept
+# from the last call and valid below dirty_row (the lowest row changed since
+# then). Only the rows from dirty_row up are swept again, and the flood fill
+# in both directions is done only when some cells are not supported from
+# below. Returns the free cells as (row, bitmask) pairs together with the
+# rows with such overhangs once the free cells are removed (which does not
+# change the support of any cell).
+def find_free_cells(row_bits, support, overhang_rows, dirty_row):
+    _sweep_up(row_bits, support, dirty_row)
+    overhang_rows = [row for row in overhang_rows if row < dirty_row]
+    overhang_rows += [row for row in range(dirty_row, len(row_bits))
+                      if row_bits[row] & ~support[row]]
+    if not overhang_rows:
+        return [], overhang_rows
+    grounded = grounded_rows(row_bits, support)
+    free_cells = [(row, row_bits[row] & ~grounded[row]) for row in overhang_rows
+                  if row_bits[row] & ~grounded[row]]
+    return free_cells, [row for row in overhang_rows if grounded[row] & ~support[row]]
+
+
+# Updates support[row] for the rows from start up with the cells connected to
+# the bottom row through the rows below them
+def _sweep_up(row_bits, support, start):
+    for row in range(start, len(row_bits)):
+        mask = row_bits[row]
+        seed = mask if row == 0 else support[row - 1] & mask
+        filled = _fill_row(seed, mask) if seed else 0
+        # the supported cells form a prefix of the rows, so nothing changes
+        # above a row without support before and after the sweep
+        if not filled and not support[row]:
+            break
+        support[row] = filled
+
+
+# Spreads the bits of seed horizontally within mask (a row bitmask)
+def _fill_row(seed, mask):
+    seed &= mask
+    while True:
+        spread = (seed | (seed << 1) | (seed >> 1)) & mask
+        if spread == seed:
+            return seed
+        seed = spread
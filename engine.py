@@ -0,0 +1,145 @@
+from tetromino import Tetromino  # the class for modeling the tetrominoes
+import random  # used for creating tetrominoes with random types (shapes)
+from collections import namedtuple  # used for the snapshots of the games
+
+# The actions that can be given to GameEngine.step
+LEFT, RIGHT, DOWN = "left", "right", "down"
+ROTATE, HARD_DROP, TICK = "rotate", "hard_drop", "tick"
+ACTIONS = (LEFT, RIGHT, DOWN, ROTATE, HARD_DROP, TICK)
+
+# The events returned by GameEngine.step as (event, value) pairs
+MOVED = "moved"  # value: the direction of the move
+ROTATED = "rotated"  # value: None
+DROPPED = "dropped"  # value: the number of rows the tetromino has fallen
+LOCKED = "locked"  # value: the score gained by locking the tetromino
+ROWS_CLEARED = "rows_cleared"  # value: the list of the cleared rows
+SPAWNED = "spawned"  # value: the tetromino that entered the game grid
+GAME_OVER = "game_over"  # value: True when the game is won
+
+# An immutable snapshot of the state of a game: the state of the game grid, the
+# states of the current and the next tetromino, the number of pieces placed,
+# whether the game is over and the state of the random number generator
+GameState = namedtuple('GameState', ['grid', 'current', 'next', 'pieces_placed',
+                                     'game_over', 'rng'])
+
+# A class that runs the rules of the game without drawing anything, so that
+# games can be played in bulk without a display. The game grid can be either a
+# GameGrid (when the game is drawn) or a BitGrid (for headless games).
+class GameEngine:
+   # the types (shapes) of the tetrominoes
+   tetromino_types = ['I', 'O', 'Z', 'L', 'J', 'S', 'T']
+
+   # A constructor for creating a game on the given game grid where the
+   # tetrominoes are created by using a random number generator with the given
+   # seed (a random seed is chosen when seed is None, and it is kept in
+   # self.seed so that the game can be replayed)
+   def __init__(self, grid, seed=None):
+      self.grid = grid
+      self.seed = random.randrange(1 << 63) if seed is None else seed
+      self.rng = random.Random(self.seed)
+      # the state of the random number generator, kept until it is used again
+      # (the snapshots taken between two tetrominoes share it)
+      self.rng_state = None
+      self.game_over = False
+      self.pieces_placed = 0
+      # create the current and the next tetromino
+      self.current_tetromino = self.create_tetromino()
+      self.next_tetromino = self.create_tetromino()
+      self.grid.current_tetromino = self.current_tetromino
+      self.grid.next_tetromino = self.next_tetromino
+
+   @property
+   def score(self):
+      return self.grid.score
+
+   @property
+   def has_won(self):
+      return self.grid.has_won
+
+   # A method for creating a random shaped tetromino to enter the game grid
+   def create_tetromino(self):
+      # the type (shape) of the tetromino is determined randomly
+      self.rng_state = None
+      random_index = self.rng.randint(0, len(self.tetromino_types) - 1)
+      random_type = self.tetromino_types[random_index]
+      # create and return the tetromino
+      return Tetromino(random_type, self.grid.grid_height,
+                       self.grid.grid_width, self.rng)
+
+   # A method that returns a snapshot of the state of the game (which can be
+   # given to restore to go back to this state)
+   def snapshot(self):
+      if self.rng_state is None:
+         self.rng_state = self.rng.getstate()
+      return GameState(self.grid.snapshot(), self.current_tetromino.get_state(),
+                       self.next_tetromino.get_state(), self.pieces_placed,
+                       self.game_over, self.rng_state)
+
+   # A method for going back to the state of the game in the given snapshot
+   def restore(self, state):
+      grid_h, grid_w = self.grid.grid_height, self.grid.grid_width
+      self.grid.restore(state.grid)
+      self.current_tetromino = Tetromino.from_state(state.current, grid_h, grid_w)
+      self.next_tetromino = Tetromino.from_state(state.next, grid_h, grid_w)
+      self.grid.current_tetromino = self.current_tetromino
+      self.grid.next_tetromino = self.next_tetromino
+      self.pieces_placed = state.pieces_placed
+      self.game_over = state.game_over
+      if state.rng is not self.rng_state:
+         self.rng.setstate(state.rng)
+         self.rng_state = state.rng
+
+   # A method that applies the given action to the game and returns the list
+   # of the resulting events (nothing happens after the game is over)
+   def step(self, action):
+      events = []
+      if self.game_over:
+         return events
+      tetromino = self.current_tetromino
+      if action == LEFT or action == RIGHT or action == DOWN:
+         if tetromino.move(action, self.grid):
+            events.append((MOVED, action))
+      elif action == ROTATE:
+         if tetromino.rotate(self.grid):
+            events.append((ROTATED, None))
+      elif action == HARD_DROP:
+         events.append((DROPPED, tetromino.hard_drop(self.grid)))
+      elif action == TICK:
+         # the tetromino falls by one and it is locked when it cannot fall
+         if tetromino.move(DOWN, self.grid):
+            events.append((MOVED, DOWN))
+         else:
+            self.lock(events)
+      else:
+         raise ValueError("unknown action: " + str(action))
+      return events
+
+   # A method for locking the current tetromino onto the game grid and letting
+   # the next tetromino enter the game grid
+   def lock(self, events):
+      score_before = self.grid.score
+      # update the game grid by locking the tiles of the landed tetromino on
+      # their cells (the tiles are not copied, the tetromino is not used again)
+      game_over = self.grid.lock_tiles(self.current_tetromino.get_tile_cells())
+      self.pieces_placed += 1
+      events.append((LOCKED, self.grid.score - score_before))
+      if self.grid.cleared_rows:
+         events.append((ROWS_CLEARED, self.grid.cleared_rows))
+      if game_over:
+         self.game_over = True
+         events.append((GAME_OVER, self.grid.has_won))
+         return
+      # create the next tetromino to enter the game grid
+      self.current_tetromino = self.next_tetromino
+      self.next_tetromino = self.create_tetromino()
+      self.grid.current_tetromino = self.current_tetromino
+      self.grid.next_tetromino = self.next_tetromino
+      events.append((SPAWNED, self.current_tetromino))
+      # the game is over when the tetromino that entered the game grid
+      # overlaps the tiles on it (checked with the row bitmasks)
+      tetromino = self.current_tetromino
+      position = tetromino.bottom_left_cell
+      if not tetromino.can_be_placed(self.grid, tetromino.rotation, position.x, position.y):
+         self.game_over = True
+         self.grid.game_over = True
+         events.append((GAME_OVER, False))
@@ -1,8 +1,12 @@
 from operator import truediv
-import pygame
 import lib.stddraw as stddraw
 from lib.color import Color
 from point import Point
+from bit_grid import find_free_cells, has_vertical_pair, merge_grid, GridState
+from bit_grid import column_heights, landing_row, board_features
+from tile import Tile
+from animation import Timeline
+import profiler
 import numpy as np
 import copy as cp
 
@@ -11,6 +15,22 @@ class GameGrid:
         self.grid_height = grid_h
         self.grid_width = grid_w
         self.tile_matrix = np.full((grid_h, grid_w), None)
+        # the occupied columns of each row as a bitmask (for the tetrominoes),
+        # the number of tiles on each row and the height of each column (the
+        # row above its highest tile), all kept up to date as the grid changes
+        self.row_bits = [0] * grid_h
+        self.row_counts = [0] * grid_h
+        self.column_heights = [0] * grid_w
+        # the tile numbers as exponents of 2 (0 for an empty cell), also kept
+        # up to date, and the cells of the tiles locked since the last merges
+        # (None when there may be equal tiles on top of each other anywhere)
+        self.exponents = np.zeros((grid_h, grid_w), dtype=np.uint8)
+        self.merge_candidates = []
+        # the support of the cells, the rows with overhangs and the lowest row
+        # changed since the free tiles were last found (see find_free_cells)
+        self.support = [0] * grid_h
+        self.overhang_rows = []
+        self.dirty_row = 0
         self.current_tetromino = None
         self.next_tetromino = None
         self.game_over = False
@@ -24,12 +44,123 @@ class GameGrid:
         self.pattern_color = Color(255, 230, 238)
         self.sidebar_width = 6
         self.score = 0
-
-    def display(self):
+        self.cleared_rows = []
+        # the cells of the tiles merged and the free tiles removed with their
+        # cells by the last lock (for the animations of the frontend)
+        self.merged_cells = []
+        self.freed_tiles = []
+        # the effects played over the tiles (see animation.py)
+        self.animations = Timeline()
+        # what was drawn on each cell and on the sidebar in the last frame
+        # (None when the whole canvas has to be drawn again)
+        self.drawn_cells = None
+        self.drawn_sidebar = None
+        # the position of each cell, for drawing the tiles on it
+        self.cell_positions = [[Point(col, row) for col in range(grid_w)]
+                               for row in range(grid_h)]
+
+    def display(self, msec=50):
+        # only the cells and the sidebar that look different from the last
+        # frame are drawn again and copied to the window (the effects of the
+        # animations are moved on to this frame first)
+        self.animations.update()
+        cells, sidebar = self.get_cell_keys(), self.get_sidebar_key()
+        if self.drawn_cells is None:
+            self.draw_all()
+            regions = None
+        else:
+            regions = []
+            for row in range(self.grid_height):
+                for col in range(self.grid_width):
+                    if cells[row][col] != self.drawn_cells[row][col]:
+                        region = (col - 0.5, row - 0.5, 1, 1)
+                        stddraw.setClip(*region)
+                        self.draw_cell(row, col)
+                        regions.append(region)
+            if sidebar != self.drawn_sidebar:
+                region = (self.grid_width - 0.5, -0.5, self.sidebar_width, self.grid_height)
+                stddraw.setClip(*region)
+                self.draw_sidebar()
+                regions.append(region)
+            stddraw.setClip()
+        self.drawn_cells, self.drawn_sidebar = cells, sidebar
+        with profiler.phase("show"):
+            if regions is None:
+                stddraw.show(msec)
+            else:
+                stddraw.showRegions(regions, msec)
+
+    def invalidate(self):
+        # the whole canvas is drawn again in the next frame (after something
+        # else has been drawn over the game grid)
+        self.drawn_cells = None
+
+    def get_cell_keys(self):
+        # what is seen on each cell: the number and the colors of the tile on
+        # it and whether it belongs to the falling tetromino
+        keys = [[None if tile is None else (tile.number, tile.background_color,
+                                            tile.foreground_color, tile.box_color, False)
+                 for tile in row] for row in self.tile_matrix]
+        if self.current_tetromino:
+            # the ghost piece is drawn over the cells where the tetromino lands
+            landing_row = self.current_tetromino.get_landing_row(self)
+            for tile, (row, col) in self.current_tetromino.get_tile_cells(landing_row):
+                if self.is_inside(row, col):
+                    keys[row][col] = (keys[row][col], "ghost", tile.box_color)
+            for tile, (row, col) in self.current_tetromino.get_tile_cells():
+                if self.is_inside(row, col):
+                    keys[row][col] = (tile.number, tile.background_color,
+                                      tile.foreground_color, tile.box_color, True)
+        # and what the effects of the animations show on the cells they cover
+        for (row, col), (effect, key) in self.animations.overlays.items():
+            keys[row][col] = (keys[row][col], key)
+        return keys
+
+    def get_sidebar_key(self):
+        # the profiler overlay on the sidebar is updated now and then
+        next_tetromino = self.next_tetromino
+        if next_tetromino is None:
+            return self.score, None, profiler.overlay_version()
+        return (self.score, next_tetromino, next_tetromino.rotation,
+                tuple(tile.number for tile in next_tetromino.tiles),
+                profiler.overlay_version())
+
+    def draw_cell(self, row, col):
+        # draws the cell in the same order as draw_all, so that it looks the
+        # same as when the whole canvas is drawn (drawing is clipped to the cell)
+        with profiler.phase("grid"):
+            self.draw_background()
+        with profiler.phase("tiles"):
+            if self.tile_matrix[row][col] is not None:
+                self.tile_matrix[row][col].draw(self.cell_positions[row][col])
+        with profiler.phase("effects"):
+            self.animations.draw((row, col), self.cell_positions[row][col])
+        with profiler.phase("piece"):
+            if self.current_tetromino:
+                self.current_tetromino.draw_ghost(self)
+                self.current_tetromino.draw()
+        with profiler.phase("bounds"):
+            self.draw_grid_boundary()
+
+    def draw_all(self):
         stddraw.clear(self.empty_cell_color)
         self.draw_grid()
-        if self.current_tetromino:
-            self.current_tetromino.draw()
+        self.draw_effects()
+        with profiler.phase("piece"):
+            if self.current_tetromino:
+                self.current_tetromino.draw_ghost(self)
+                self.current_tetromino.draw()
+        self.draw_sidebar()
+
+    def draw_sidebar(self):
+        with profiler.phase("sidebar"):
+            self.draw_sidebar_panel()
+        with profiler.phase("bounds"):
+            self.draw_grid_boundary()
+
+    def draw_sidebar_panel(self):
+        stddraw.setPenColor(self.empty_cell_color)
+        stddraw.filledRectangle(self.grid_width - 0.5, -0.5, self.sidebar_width, self.grid_height)
         self.draw_next_tetromino()
 
         # Score text
@@ -43,16 +174,31 @@ class GameGrid:
         # Add instructions
         stddraw.setFontSize(12)
         stddraw.setPenColor(Color(150, 150, 150))
+        stddraw.text(self.grid_width + self.sidebar_width / 2, 4, "A: Autoplay")
+        stddraw.text(self.grid_width + self.sidebar_width / 2, 3, "U: Undo")
         stddraw.text(self.grid_width + self.sidebar_width / 2, 2, "P: Pause")
         stddraw.text(self.grid_width + self.sidebar_width / 2, 1, "R: Restart")
-
+        # the times of the phases of the frames (see profiler.py)
+        if profiler.is_enabled():
+            profiler.draw_overlay(self.grid_width + self.sidebar_width / 2 - 0.5,
+                                  self.grid_height - 9.3)
+
+    def draw_grid_boundary(self):
+        # the boundaries are drawn once as a transparent layer over the tiles
+        # (which is a bit wider than the grid for the thick separator line)
+        key = ("boundary", self.grid_width, self.grid_height, str(self.boundary_color),
+               self.box_thickness)
+        width = self.grid_width + 0.25
+        stddraw.cachedDrawing(key, width / 2 - 0.5, (self.grid_height - 1) / 2,
+                              width, self.grid_height, self.draw_boundary_layer)
+
+    def draw_boundary_layer(self):
         self.draw_boundaries()
 
         stddraw.setPenColor(self.boundary_color)
         stddraw.setPenRadius(self.box_thickness)
         stddraw.line(self.grid_width - 0.5, -0.5, self.grid_width - 0.5, self.grid_height - 0.5)
         stddraw.setPenRadius()
-        stddraw.show(400)
 
     def draw_next_tetromino(self):
         if self.next_tetromino is not None:
@@ -63,19 +209,48 @@ class GameGrid:
 
             original_pos = cp.copy(self.next_tetromino.bottom_left_cell)
 
-            preview_size = len(self.next_tetromino.tile_matrix)
+            state = self.next_tetromino.rotation_states[self.next_tetromino.rotation]
+            preview_size = state.n
             self.next_tetromino.bottom_left_cell.x = self.grid_width + (self.sidebar_width - preview_size) / 2
             self.next_tetromino.bottom_left_cell.y = self.grid_height - 5
 
-            for row in range(preview_size):
-                for col in range(preview_size):
-                    if self.next_tetromino.tile_matrix[row][col] is not None:
-                        pos = self.next_tetromino.get_cell_position(row, col)
-                        self.next_tetromino.tile_matrix[row][col].draw(pos, 0.8)
+            pos = None
+            for tile, (row, col) in zip(self.next_tetromino.tiles, state.cells):
+                pos = self.next_tetromino.get_cell_position(row, col, pos)
+                tile.draw(pos, 0.8)
 
             self.next_tetromino.bottom_left_cell = original_pos
 
     def draw_grid(self):
+        with profiler.phase("grid"):
+            self.draw_background()
+
+        with profiler.phase("tiles"):
+            for row in range(self.grid_height):
+                for col in range(self.grid_width):
+                    if self.tile_matrix[row][col] is not None:
+                        self.tile_matrix[row][col].draw(self.cell_positions[row][col])
+
+    def draw_effects(self):
+        # the effects of the animations are drawn over the tiles they cover
+        with profiler.phase("effects"):
+            for cell in self.animations.overlays:
+                row, col = cell
+                self.animations.draw(cell, self.cell_positions[row][col])
+
+    def draw_background(self):
+        # the empty cells and the grid lines never change, so they are drawn
+        # once as a layer and copied in one go (they are drawn again only for
+        # another canvas size or other colors)
+        key = ("background", self.grid_width, self.grid_height, self.grid_pattern,
+               str(self.empty_cell_color), str(self.pattern_color), str(self.line_color),
+               self.line_thickness)
+        stddraw.cachedDrawing(key, (self.grid_width - 1) / 2, (self.grid_height - 1) / 2,
+                              self.grid_width, self.grid_height, self.draw_background_layer)
+
+    def draw_background_layer(self):
+        stddraw.setPenColor(self.empty_cell_color)
+        stddraw.filledRectangle(-0.5, -0.5, self.grid_width, self.grid_height)
         if self.grid_pattern:
             stddraw.setPenColor(self.pattern_color)
             for x in range(self.grid_width):
@@ -83,11 +258,6 @@ class GameGrid:
                     if (x + y) % 2 == 0:
                         stddraw.filledSquare(x, y, 0.5)
 
-        for row in range(self.grid_height):
-            for col in range(self.grid_width):
-                if self.tile_matrix[row][col] is not None:
-                    self.tile_matrix[row][col].draw(Point(col, row))
-
         stddraw.setPenColor(self.line_color)
         stddraw.setPenRadius(self.line_thickness)
         for x in range(1, self.grid_width):
@@ -108,8 +278,42 @@ class GameGrid:
     def is_inside(self, row, col):
         return 0 <= row < self.grid_height and 0 <= col < self.grid_width
 
+    def sync_row_bits(self):
+        # rebuilds the row bitmasks, the row counts, the column heights and
+        # the exponents from the tile matrix
+        for row in range(self.grid_height):
+            bits = 0
+            for col in range(self.grid_width):
+                tile = self.tile_matrix[row][col]
+                if tile is not None:
+                    bits |= 1 << col
+                    self.exponents[row, col] = tile.number.bit_length() - 1
+                else:
+                    self.exponents[row, col] = 0
+            self.row_bits[row] = bits
+            self.row_counts[row] = bin(bits).count("1")
+        self.column_heights = column_heights(self.row_bits, self.grid_width)
+        self.merge_candidates = None
+        self.dirty_row = 0
+
+    def get_column_heights(self):
+        return self.column_heights
+
+    def get_row_counts(self):
+        return self.row_counts
+
+    def get_features(self):
+        # the features of the board computed from the heights and the counts
+        # (see bit_grid.board_features)
+        return board_features(self.column_heights, self.row_counts)
+
+    def get_landing_row(self, state, x, y):
+        # the row to which a tetromino in the given rotation state drops from
+        # (x, y) (see bit_grid.landing_row)
+        return landing_row(self.row_bits, self.get_column_heights(), state.down_edges, x, y)
+
     def is_full(self, row):
-        return all(self.tile_matrix[row][col] is not None for col in range(self.grid_width))
+        return self.row_counts[row] == self.grid_width
 
     def remove_full_rows(self):
         row = self.grid_height - 1
@@ -123,92 +327,119 @@ class GameGrid:
                 for r in range(row, self.grid_height - 1):
                     self.tile_matrix[r] = self.tile_matrix[r + 1].copy()
                 self.tile_matrix[self.grid_height - 1] = np.full(self.grid_width, None)
+                self.exponents[row:-1] = self.exponents[row + 1:]
+                self.exponents[-1] = 0
+                self.dirty_row = min(self.dirty_row, row)
+                # the rows above move down and every column loses one tile
+                for counts in (self.row_bits, self.row_counts):
+                    del counts[row]
+                    counts.append(0)
+                # the merged and the free tiles are animated where they are seen
+                self.merged_cells = [(r - 1 if r > row else r, c)
+                                     for r, c in self.merged_cells if r != row]
+                self.freed_tiles = [(tile, (r - 1 if r > row else r, c))
+                                    for tile, (r, c) in self.freed_tiles if r != row]
+                self.column_heights = [height - 1 for height in self.column_heights]
             else:
                 row -= 1
-
         if cleared_rows:
-            try:
-                sound_effect = pygame.mixer.Sound('bubblepop.mp3')
-                sound_effect.set_volume(0.2)
-                sound_effect.play()
-            except:
-                pass  # Fail silently if sound can't play
-            self.animate_row_clear(cleared_rows)
+            # a column whose top tile was cleared may have gaps under it, and
+            # the tiles that have moved down may be equal to the ones under them
+            self.lower_column_heights((1 << self.grid_width) - 1)
+            self.merge_candidates = None
+        # the sound and the animation are left to the frontend (see GameEngine)
+        self.cleared_rows = cleared_rows
         return len(cleared_rows)
 
-    def animate_row_clear(self, rows):
-        frames = 6
-        for frame in range(frames):
-            for row in rows:
-                for col in range(self.grid_width):
-                    tile = self.tile_matrix[row][col]
-                    if tile:
-                        if frame % 2 == 0:
-                            if frame == 0:
-                                tile.original_bg = tile.background_color
-                                tile.original_fg = tile.foreground_color
-                                tile.original_box = tile.box_color
-                            tile.background_color = Color(255, 255, 255)
-                            tile.foreground_color = Color(255, 255, 255)
-                            tile.box_color = Color(255, 255, 255)
-                        else:
-                            tile.background_color = tile.original_bg
-                            tile.foreground_color = tile.original_fg
-                            tile.box_color = tile.original_box
-            self.display()
-            stddraw.show(50)
-
     def update_grid(self, tiles_to_lock, blc_position):
-        self.current_tetromino = None
         n_rows, n_cols = len(tiles_to_lock), len(tiles_to_lock[0])
-
+        tile_cells = []
         for row in range(n_rows):
             for col in range(n_cols):
                 tile = tiles_to_lock[row][col]
                 if tile:
-                    x = blc_position.x + col
-                    y = blc_position.y + (n_rows - 1 - row)
-                    if self.is_inside(y, x):
-                        self.tile_matrix[y][x] = tile
-                    else:
-                        self.game_over = True
-
-        self.merge_vertical_tiles()
-        self.handle_free_tiles()
-        self.remove_full_rows()
+                    tile_cells.append((tile, (blc_position.y + (n_rows - 1 - row),
+                                              blc_position.x + col)))
+        return self.lock_tiles(tile_cells)
+
+    def lock_tiles(self, tile_cells):
+        # tile_cells is a list of (tile, (row, col)) as from Tetromino.get_tile_cells,
+        # whose tiles are placed on the grid as they are (not copied)
+        self.current_tetromino = None
+        self.merged_cells, self.freed_tiles = [], []
+        for tile, (y, x) in tile_cells:
+            if self.is_inside(y, x):
+                if self.tile_matrix[y][x] is None:
+                    self.row_bits[y] |= 1 << x
+                    self.row_counts[y] += 1
+                    self.column_heights[x] = max(self.column_heights[x], y + 1)
+                    self.dirty_row = min(self.dirty_row, y)
+                self.tile_matrix[y][x] = tile
+                self.exponents[y, x] = tile.number.bit_length() - 1
+                if self.merge_candidates is not None:
+                    self.merge_candidates.append((y, x))
+            else:
+                self.game_over = True
+
+        with profiler.phase("merge"):
+            self.merge_vertical_tiles()
+        with profiler.phase("free"):
+            self.handle_free_tiles()
+        with profiler.phase("rows"):
+            self.remove_full_rows()
         return self.game_over
 
-    def merge_vertical_tiles(self):
-        merged = True
-        while merged:
-            merged = False
+    def get_exponents(self):
+        # the tile numbers as exponents of 2 (0 for an empty cell)
+        return self.exponents.copy()
+
+    def snapshot(self):
+        return GridState(self.exponents.tobytes(), tuple(self.row_bits), self.score,
+                         self.game_over, self.has_won)
+
+    def restore(self, state):
+        exponents = np.frombuffer(state.exponents, dtype=np.uint8).reshape(
+            self.grid_height, self.grid_width)
+        self.tile_matrix = np.full((self.grid_height, self.grid_width), None)
+        for row in range(self.grid_height):
             for col in range(self.grid_width):
-                row = 0
-                while row < self.grid_height - 1:
-                    current = self.tile_matrix[row][col]
-                    above = self.tile_matrix[row + 1][col]
-
-                    if current is not None and above is not None:
-                        if current.number == above.number:
-                            # Merge logic
-                            current.number *= 2
-                            current.set_color_by_number()  #  update color
-                            self.score += current.number
-                            self.tile_matrix[row + 1][col] = None
-                            merged = True
-
-                            # Check for win
-                            if current.number == 2048:
-                                self.game_over = True
-                                self.has_won = True
-                                print("YOU WIN!")
-
-                            # Skip next row to avoid double merge in same pass
-                            row += 2
-                            continue
-                    row += 1
-            if merged:
-                self.apply_gravity()
+                if exponents[row, col]:
+                    self.tile_matrix[row][col] = Tile(1 << int(exponents[row, col]))
+        self.score, self.game_over, self.has_won = state.score, state.game_over, state.has_won
+        self.cleared_rows, self.merged_cells, self.freed_tiles = [], [], []
+        self.animations.clear()
+        self.sync_row_bits()
+        self.invalidate()
+
+    def merge_vertical_tiles(self):
+        # nothing is done unless two equal tiles are on top of each other
+        # (only the cells locked since the last merges are looked at, see
+        # has_vertical_pair); otherwise the exponents are merged by the rules
+        # shared with BitGrid (see merge_grid) and the tiles follow them
+        candidates, self.merge_candidates = self.merge_candidates, []
+        if not has_vertical_pair(self.exponents, candidates):
+            return 0
+        merges, score, won, changes = merge_grid(self.exponents, self.column_heights)
+        self.score += score
+        for col, origins, merged in changes:
+            tiles = list(self.tile_matrix[:len(origins), col])
+            for row, origin in enumerate(origins):
+                tile = None if origin is None else tiles[origin]
+                self.tile_matrix[row][col] = tile
+                # the lower tile of each merged pair keeps its place in the
+                # animations, the upper one is gone
+                if origin in merged:
+                    tile.number = 1 << int(self.exponents[row, col])
+                    tile.set_color_by_number()  #  update color
+                    self.merged_cells.append((row, col))
+        self.set_compacted(self.exponents != 0)
+
+        # Check for win
+        if won:
+            self.game_over = True
+            self.has_won = True
+            print("YOU WIN!")
+        return merges
 
 
     def apply_gravity(self):
@@ -217,25 +448,53 @@ class GameGrid:
             stack += [None] * (self.grid_height - len(stack))
             for row in range(self.grid_height):
                 self.tile_matrix[row][col] = stack[row]
-
-    def handle_free_tiles(self):
-        visited = set()
-
-        def dfs(row, col):
-            if (row, col) in visited:
-                return
-            visited.add((row, col))
-            for dr, dc in [(-1,0), (1,0), (0,-1), (0,1)]:
-                nr, nc = row + dr, col + dc
-                if self.is_inside(nr, nc) and self.tile_matrix[nr][nc]:
-                    dfs(nr, nc)
-
+            self.exponents[:, col] = [0 if tile is None else tile.number.bit_length() - 1
+                                      for tile in stack]
+        self.set_compacted(self.exponents != 0)
+        # the tiles that have fallen may be equal to the ones under them
+        self.merge_candidates = None
+
+    def lower_column_heights(self, columns):
+        # lowers the heights of the given columns (as a bitmask) that have
+        # lost their top tiles down to the highest tile left on them
         for col in range(self.grid_width):
-            if self.tile_matrix[0][col]:
-                dfs(0, col)
+            if (columns >> col) & 1:
+                height = self.column_heights[col]
+                while height > 0 and not (self.row_bits[height - 1] >> col) & 1:
+                    height -= 1
+                self.column_heights[col] = height
+
+    def set_compacted(self, occupied):
+        # updates the row bitmasks, the row counts and the column heights after
+        # gravity, when the tiles of each column are at its bottom (occupied
+        # is a boolean array of the occupied cells)
+        packed = np.packbits(occupied, axis=1, bitorder='little')
+        row_bits = [int.from_bytes(row.tobytes(), 'little') for row in packed]
+        for row in range(min(self.dirty_row, self.grid_height)):
+            if row_bits[row] != self.row_bits[row]:
+                self.dirty_row = row
+                break
+        self.row_bits = row_bits
+        self.row_counts = [int(count) for count in occupied.sum(axis=1)]
+        self.column_heights = [int(height) for height in occupied.sum(axis=0)]
 
-        for row in range(self.grid_height):
+    def handle_free_tiles(self):
+        # the tiles that are not connected to the bottom row are found over
+        # the row bitmasks, only from the lowest row changed since the last
+        # time up (see find_free_cells)
+        free_cells, self.overhang_rows = find_free_cells(
+            self.row_bits, self.support, self.overhang_rows, self.dirty_row)
+        self.dirty_row = self.grid_height
+
+        changed_columns = 0
+        for row, free in free_cells:
             for col in range(self.grid_width):
-                if self.tile_matrix[row][col] and (row, col) not in visited:
+                if (free >> col) & 1:
+                    self.freed_tiles.append((self.tile_matrix[row][col], (row, col)))
                     self.score += self.tile_matrix[row][col].number
                     self.tile_matrix[row][col] = None
+                    self.exponents[row, col] = 0
+                    self.row_counts[row] -= 1
+            self.row_bits[row] &= ~free
+            changed_columns |= free
+        self.lower_column_heights(changed_columns)
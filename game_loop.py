@@ -0,0 +1,69 @@
+import time  # the monotonic clock used for timing the ticks and the frames
+
+# A class for running a game with a fixed-timestep loop: the game logic is
+# updated with a fixed time step (ticks per second) measured on a monotonic
+# clock, however long drawing a frame takes, and the frames are drawn at most
+# at the given frame rate
+class GameLoop:
+   # the most ticks run before a frame is drawn, so that the game catches up
+   # after a slow frame without falling further behind
+   max_ticks_per_frame = 5
+
+   # A constructor for creating a loop that calls update (with the duration
+   # of a tick in seconds) logic_hz times per second and render once per frame,
+   # at most max_fps times per second (no limit when max_fps is None)
+   def __init__(self, update, render, logic_hz=60, max_fps=60,
+                clock=time.perf_counter, sleep=time.sleep):
+      self.update = update
+      self.render = render
+      self.tick_duration = 1.0 / logic_hz
+      self.frame_duration = 0.0 if max_fps is None else 1.0 / max_fps
+      self.clock = clock
+      self.sleep = sleep
+      self.running = False
+      # the number of ticks and frames so far and their measured rates (per
+      # second, updated once a second)
+      self.ticks = 0
+      self.frames = 0
+      self.tick_rate = 0.0
+      self.frame_rate = 0.0
+
+   # A method for ending the loop (after the current tick or frame)
+   def stop(self):
+      self.running = False
+
+   # A method that runs the loop until stop is called
+   def run(self):
+      self.running = True
+      previous = self.clock()
+      accumulator = 0.0
+      rate_start, rate_ticks, rate_frames = previous, self.ticks, self.frames
+      while self.running:
+         frame_start = self.clock()
+         accumulator += frame_start - previous
+         previous = frame_start
+         # run the ticks that are due (the time left over is kept for the
+         # next frame)
+         ticks = 0
+         while accumulator >= self.tick_duration and self.running:
+            if ticks == self.max_ticks_per_frame:
+               accumulator = 0.0  # drop the time that cannot be caught up
+               break
+            self.update(self.tick_duration)
+            self.ticks += 1
+            ticks += 1
+            accumulator -= self.tick_duration
+         if not self.running:
+            break
+         self.render()
+         self.frames += 1
+         # measure the tick and frame rates
+         now = self.clock()
+         if now - rate_start >= 1.0:
+            self.tick_rate = (self.ticks - rate_ticks) / (now - rate_start)
+            self.frame_rate = (self.frames - rate_frames) / (now - rate_start)
+            rate_start, rate_ticks, rate_frames = now, self.ticks, self.frames
+         # wait for the next frame when the frame rate is capped
+         wait = frame_start + self.frame_duration - now
+         if wait > 0:
+            self.sleep(wait)
@@ -9,9 +9,13 @@ objects.
 
 class Color:
     """
-    A Color object models an RGB color.
+    A Color object models an RGB color. Colors with the same
+    components are equal (and have the same hash).
     """
 
+    # The components are kept in slots, as there are many colors.
+    __slots__ = ('_r', '_g', '_b')
+
     #-------------------------------------------------------------------
 
     def __init__(self, r=0, g=0, b=0):
@@ -49,6 +53,26 @@ class Color:
 
     #-------------------------------------------------------------------
 
+    def __eq__(self, other):
+        """
+        Return True if other is a Color with the same components
+        as self.
+        """
+        if not isinstance(other, Color):
+            return NotImplemented
+        return (self._r == other._r and self._g == other._g
+                and self._b == other._b)
+
+    #-------------------------------------------------------------------
+
+    def __hash__(self):
+        """
+        Return the hash of the components of self.
+        """
+        return hash((self._r, self._g, self._b))
+
+    #-------------------------------------------------------------------
+
     def __str__(self):
         """
         Return the string equivalent of self, that is, a
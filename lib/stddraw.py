@@ -8,17 +8,19 @@ commonly used Color objects defined in the color module.
 """
 
 import time
+import math
+import functools
+import collections
 import os
 import sys
 
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = 'hide'
 import pygame
-import pygame.gfxdraw
 import pygame.font
 
-import tkinter as Tkinter
-import tkinter.messagebox as tkMessageBox
-import tkinter.filedialog as tkFileDialog
+# pygame.gfxdraw and tkinter are imported where they are used (tkinter is
+# used only by the dialog boxes of the child processes), so that importing
+# this module is fast.
 	
 #-----------------------------------------------------------------------
 
@@ -80,8 +82,16 @@ _DEFAULT_CANVAS_SIZE = 512
 _DEFAULT_PEN_RADIUS = .005  # Maybe change this to 0.0 in the future.
 _DEFAULT_PEN_COLOR = BLACK
 
+# The kinds of the key events
+KEY_DOWN = 'down'
+KEY_UP = 'up'
+
 _DEFAULT_FONT_FAMILY = 'Helvetica'
 _DEFAULT_FONT_SIZE = 12
+# The number of fonts kept loaded for text() and boldText()
+_FONT_CACHE_SIZE = 32
+# The number of drawings kept by cachedDrawing()
+_SPRITE_CACHE_SIZE = 256
 
 _xmin = None
 _ymin = None
@@ -95,7 +105,13 @@ _canvasWidth = float(_DEFAULT_CANVAS_SIZE)
 _canvasHeight = float(_DEFAULT_CANVAS_SIZE)
 _penRadius = None
 _penColor = _DEFAULT_PEN_COLOR
-_keysTyped = []
+_keysTyped = collections.deque()
+# The key presses and releases as (kind, key, time) tuples, where kind is
+# KEY_DOWN or KEY_UP and time is from time.perf_counter()
+_keyEvents = collections.deque()
+# The keys that are being held down
+_keysHeld = set()
+_sprites = {}
 
 # Has the window been created?
 _windowCreated = False
@@ -267,6 +283,7 @@ def _pixel(x, y):
     """
     Draw on the background canvas a pixel at (x, y).
     """
+    import pygame.gfxdraw
     _makeSureWindowCreated()
     xs = _scaleX(x)
     xy = _scaleY(y)
@@ -489,7 +506,7 @@ def text(x, y, s):
     y = float(y)
     xs = _scaleX(x)
     ys = _scaleY(y)
-    font = pygame.font.SysFont(_fontFamily, _fontSize)
+    font = _getFont(_fontFamily, _fontSize)
     text = font.render(s, 1, _pygameColor(_penColor))
     textpos = text.get_rect(center=(xs, ys))
     _surface.blit(text, textpos)
@@ -503,11 +520,29 @@ def boldText(x, y, s):
     y = float(y)
     xs = _scaleX(x)
     ys = _scaleY(y)
-    font = pygame.font.SysFont(_fontFamily, _fontSize, True)
+    font = _getFont(_fontFamily, _fontSize, True)
     text = font.render(s, 1, _pygameColor(_penColor))
     textpos = text.get_rect(center=(xs, ys))
     _surface.blit(text, textpos)
 
+@functools.lru_cache(maxsize=_FONT_CACHE_SIZE)
+def _getFont(family, size, bold=False):
+    """
+    Return the pygame font for the given family, size and boldness.
+    Looking up and loading a system font is slow, so the most recently
+    used fonts are kept.
+    """
+    return pygame.font.SysFont(family, size, bold)
+
+def preloadFonts(fonts):
+    """
+    Load the given fonts, each a (family, size) or (family, size, bold)
+    tuple, so that the first text drawn with them does not have to wait
+    for the font to be looked up.
+    """
+    for font in fonts:
+        _getFont(*font)
+
 def picture(pic, x=None, y=None):
     """
     Draw pic on the background canvas centered at (x, y).  pic is an
@@ -530,6 +565,56 @@ def picture(pic, x=None, y=None):
     picSurface = pic._surface # violates encapsulation
     _surface.blit(picSurface, [xs-ws/2.0, ys-hs/2.0, ws, hs])
 
+def setClip(x=None, y=None, w=None, h=None):
+    """
+    Restrict the drawing on the background canvas to the rectangle of
+    width w and height h whose lower left point is (x, y). Calling
+    setClip() without arguments allows drawing on the whole canvas.
+    """
+    _makeSureWindowCreated()
+    if x is None:
+        _surface.set_clip(None)
+    else:
+        _surface.set_clip(_regionRect(x, y, w, h))
+
+def cachedDrawing(key, x, y, w, h, draw):
+    """
+    Draw on the background canvas what the function draw draws inside
+    the rectangle of width w and height h centered on (x, y). The
+    drawing is made off-screen once for each key (and size in pixels)
+    and then copied, so key must tell apart everything that draw
+    depends on apart from the position.
+    """
+    global _surface
+    _makeSureWindowCreated()
+    rect = _regionRect(x - w / 2.0, y - h / 2.0, w, h)
+    # a drawing that is not inside the canvas is drawn as it is
+    if not _surface.get_rect().contains(rect):
+        draw()
+        return
+    # the position of the drawing within the pixels it covers
+    offset = (round(_scaleX(float(x)) - rect.x, 3),
+              round(_scaleY(float(y)) - rect.y, 3))
+    spriteKey = (key, rect.size, offset)
+    sprite = _sprites.get(spriteKey)
+    if sprite is None:
+        if len(_sprites) >= _SPRITE_CACHE_SIZE:
+            _sprites.clear()
+        # the drawing is made on a transparent canvas of the same size
+        canvas = _surface
+        _surface = pygame.Surface(canvas.get_size(), pygame.SRCALPHA)
+        try:
+            draw()
+            sprite = _surface.subsurface(rect).copy()
+        finally:
+            _surface = canvas
+        # a drawing that covers all its pixels is copied faster without
+        # the transparency
+        if pygame.mask.from_surface(sprite, 254).count() == rect.w * rect.h:
+            sprite = sprite.convert(_surface)
+        _sprites[spriteKey] = sprite
+    _surface.blit(sprite, rect)
+
 def clear(c=WHITE):
     """
     Clear the background canvas to color c, where c is an
@@ -589,7 +674,44 @@ def show(msec=float('inf')):
     _makeSureWindowCreated()
     _show()
     _checkForEvents()
+    _wait(msec)
 
+def showRegions(regions, msec=0):
+    """
+    Copy only the given regions of the background canvas to the window
+    canvas, and then wait for msec milliseconds. Each region is a tuple
+    (x, y, w, h) for a rectangle of width w and height h whose lower
+    left point is (x, y). Only the copied regions of the window are
+    updated, so this costs less than show() when little has changed.
+    """
+    _makeSureWindowCreated()
+    rects = []
+    for x, y, w, h in regions:
+        rect = _regionRect(x, y, w, h)
+        _background.blit(_surface, rect, rect)
+        rects.append(rect)
+    if rects:
+        pygame.display.update(rects)
+    _checkForEvents()
+    _wait(msec)
+
+def _regionRect(x, y, w, h):
+    """
+    Return the pygame.Rect of the pixels covered by the rectangle of
+    width w and height h whose lower left point is (x, y).
+    """
+    xs0 = _scaleX(float(x))
+    xs1 = _scaleX(float(x) + float(w))
+    ys0 = _scaleY(float(y) + float(h))
+    ys1 = _scaleY(float(y))
+    left, top = int(math.floor(xs0)), int(math.floor(ys0))
+    return pygame.Rect(left, top, int(math.ceil(xs1)) - left,
+                       int(math.ceil(ys1)) - top)
+
+def _wait(msec):
+    """
+    Wait for msec milliseconds, checking for events in the meantime.
+    """
     # Sleep for the required time, but check for events every
     # QUANTUM seconds.
     QUANTUM = .01
@@ -668,7 +790,14 @@ def _checkForEvents():
         if event.type == pygame.QUIT:
             sys.exit()
         elif event.type == pygame.KEYDOWN:
-            _keysTyped = [pygame.key.name(event.key)] + _keysTyped
+            key = pygame.key.name(event.key)
+            _keysTyped.append(key)
+            _keyEvents.append((KEY_DOWN, key, time.perf_counter()))
+            _keysHeld.add(key)
+        elif event.type == pygame.KEYUP:
+            key = pygame.key.name(event.key)
+            _keyEvents.append((KEY_UP, key, time.perf_counter()))
+            _keysHeld.discard(key)
         elif (event.type == pygame.MOUSEBUTTONUP) and \
             (event.button == 3):
             _saveToFile()
@@ -696,7 +825,7 @@ def hasNextKeyTyped():
     Otherwise return False.
     """
     global _keysTyped
-    return _keysTyped != []
+    return len(_keysTyped) > 0
 
 def nextKeyTyped():
     """
@@ -704,14 +833,43 @@ def nextKeyTyped():
     and return that key.
     """
     global _keysTyped
-    return _keysTyped.pop()
+    return _keysTyped.popleft()
 
 def clearKeysTyped():
     """
     Clear all the keys in the queue of the keys that the user typed.
     """
     global _keysTyped
-    _keysTyped = []
+    _keysTyped.clear()
+
+def hasNextKeyEvent():
+    """
+    Return True if the queue of the key presses and releases is not
+    empty. Otherwise return False.
+    """
+    return len(_keyEvents) > 0
+
+def nextKeyEvent():
+    """
+    Remove the first event from the queue of the key presses and
+    releases, and return it as a (kind, key, time) tuple, where kind is
+    KEY_DOWN or KEY_UP and time is the time.perf_counter() value at
+    which the event was read.
+    """
+    return _keyEvents.popleft()
+
+def clearKeyEvents():
+    """
+    Clear all the events in the queue of the key presses and releases.
+    """
+    _keyEvents.clear()
+
+def isKeyHeld(key):
+    """
+    Return True if the given key is being held down. Otherwise return
+    False.
+    """
+    return key in _keysHeld
 
 #-----------------------------------------------------------------------
 # Begin added by Alan J. Broder
@@ -777,6 +935,8 @@ def _getFileName():
     """
     Display a dialog box that asks the user for a file name.
     """
+    import tkinter as Tkinter
+    import tkinter.filedialog as tkFileDialog
     root = Tkinter.Tk()
     root.withdraw()
     reply = tkFileDialog.asksaveasfilename(initialdir='.')
@@ -788,6 +948,8 @@ def _confirmFileSave():
     """
     Display a dialog box that confirms a file save operation.
     """
+    import tkinter as Tkinter
+    import tkinter.messagebox as tkMessageBox
     root = Tkinter.Tk()
     root.withdraw()
     tkMessageBox.showinfo(title='File Save Confirmation',
@@ -799,6 +961,8 @@ def _reportFileSaveError(msg):
     Display a dialog box that reports a msg.  msg is a string which
     describes an error in a file save operation.
     """
+    import tkinter as Tkinter
+    import tkinter.messagebox as tkMessageBox
     root = Tkinter.Tk()
     root.withdraw()
     tkMessageBox.showerror(title='File Save Error', message=msg)
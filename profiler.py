@@ -0,0 +1,136 @@
+################################################################################
+#                                                                              #
+# Timers for the phases of a frame of Tetris 2048 and an overlay for them      #
+#                                                                              #
+# The phases are timed with                                                    #
+#    with profiler.phase("name"):                                              #
+#       ...                                                                    #
+# which costs almost nothing while the profiler is turned off. The time of    #
+# each phase is added up over a frame, and end_frame keeps the totals of the   #
+# last WINDOW frames for the averages and the 99th percentiles drawn by        #
+# draw_overlay. A cProfile capture of the next frames can also be written to   #
+# a file with start_capture.                                                   #
+#                                                                              #
+################################################################################
+
+import collections  # used for keeping the times of the last frames
+import time  # the monotonic clock used for timing the phases
+import lib.stddraw as stddraw  # used for drawing the overlay
+from lib.color import Color  # used for coloring the overlay
+
+# the number of frames over which the averages and the percentiles are taken
+# and the number of frames between two updates of the overlay
+WINDOW = 120
+OVERLAY_FRAMES = 30
+
+# whether the phases are timed, the times of the phases in the current frame,
+# the times of the last frames for each phase (in the order in which the
+# phases were first timed) and the number of frames so far
+_enabled = False
+_current = collections.defaultdict(float)
+_samples = {}
+_frames = 0
+# the profile of a cProfile capture, the frames left and the file it goes to
+_capture = None
+
+# A class for timing one phase (the time is added to the current frame)
+class _Timer:
+   def __init__(self, name):
+      self.name = name
+
+   def __enter__(self):
+      self.start = time.perf_counter()
+
+   def __exit__(self, *exception):
+      _current[self.name] += time.perf_counter() - self.start
+
+# A class for the phases timed while the profiler is turned off
+class _NoTimer:
+   def __enter__(self):
+      pass
+
+   def __exit__(self, *exception):
+      pass
+
+_NO_TIMER = _NoTimer()
+
+# A function for turning the timing of the phases on or off
+def set_enabled(enabled):
+   global _enabled
+   _enabled = enabled
+   _current.clear()
+   _samples.clear()
+
+# A function that returns True when the phases are timed
+def is_enabled():
+   return _enabled
+
+# A function that returns a context manager that times the phase with the
+# given name (the phases can be nested, each one is timed on its own)
+def phase(name):
+   return _Timer(name) if _enabled else _NO_TIMER
+
+# A function for ending a frame: the times of the phases in the frame are kept
+# and the cProfile capture is ended after its last frame
+def end_frame():
+   global _frames, _capture
+   _frames += 1
+   if _enabled:
+      for name in _current:
+         if name not in _samples:
+            _samples[name] = collections.deque(maxlen=WINDOW)
+      for name, samples in _samples.items():
+         samples.append(_current[name])
+      _current.clear()
+   if _capture is not None:
+      profile, frames, filename = _capture
+      if frames <= 1:
+         profile.disable()
+         profile.dump_stats(filename)
+         print("Profile of the frames written to", filename)
+         _capture = None
+      else:
+         _capture = (profile, frames - 1, filename)
+
+# A function that returns the average and the 99th percentile of the time of
+# each phase over the last frames (in milliseconds) as (name, average, p99)
+def summary():
+   rows = []
+   for name, samples in _samples.items():
+      ordered = sorted(samples)
+      p99 = ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+      rows.append((name, 1000 * sum(ordered) / len(ordered), 1000 * p99))
+   return rows
+
+# A function that returns a number which changes every OVERLAY_FRAMES frames
+# while the profiler is turned on (None when it is off), for redrawing the
+# overlay
+def overlay_version():
+   return _frames // OVERLAY_FRAMES if _enabled else None
+
+# A function for drawing the summary of the phases as a table with its top
+# center at (x, y) and the given row height
+def draw_overlay(x, y, row_height=0.4):
+   stddraw.setFontFamily("Arial")
+   stddraw.setFontSize(12)
+   stddraw.setPenColor(Color(120, 120, 120))
+   rows = [("ms", "avg", "p99")]
+   rows += [(name, "%.2f" % average, "%.2f" % p99) for name, average, p99 in summary()]
+   for i, (name, average, p99) in enumerate(rows):
+      row_y = y - (i + 0.5) * row_height
+      stddraw.text(x - 1.5, row_y, name)
+      stddraw.text(x + 0.5, row_y, average)
+      stddraw.text(x + 1.8, row_y, p99)
+
+# A function for starting a cProfile capture of the given number of frames,
+# which is written to the given file (as for pstats) after the last frame
+def start_capture(frames, filename):
+   global _capture
+   # cProfile is imported only for a capture (not when the game starts)
+   import cProfile
+   if _capture is not None:
+      return False  # a capture is already running
+   profile = cProfile.Profile()
+   _capture = (profile, frames, filename)
+   profile.enable()
+   return True
@@ -0,0 +1,190 @@
+################################################################################
+#                                                                              #
+# Recording and playback of games of Tetris 2048                               #
+#                                                                              #
+# Usage: python replay.py REPLAY_FILE [REPLAY_FILE ...]                        #
+#                                                                              #
+# Plays the recorded games without a display as fast as possible and checks    #
+# that the final score and the final board are the same as when they were      #
+# recorded.                                                                    #
+#                                                                              #
+################################################################################
+
+import argparse  # for parsing the command line arguments
+import hashlib  # used for hashing the final board
+import sys
+from bit_grid import BitGrid  # the headless game grid used for playback
+from engine import GameEngine, ACTIONS  # the rules of the game
+
+# The file format (all the integers are unsigned LEB128 varints):
+#   MAGIC, the format version (one byte), the seed, the grid height and width,
+#   the number of actions, then one varint per action:
+#     (frames since the previous action << 3) | (index of the action in ACTIONS)
+#   and at the end the final score, the pieces placed and the board hash
+#   (BOARD_HASH_SIZE bytes)
+MAGIC = b"T2KR"
+VERSION = 2  # 2: the game is over when a new tetromino overlaps the tiles
+BOARD_HASH_SIZE = 8
+
+# A function that returns a hash of the tiles on the given game grid (GameGrid
+# or BitGrid), which is the same for both kinds of game grids
+def board_hash(grid):
+   exponents = grid.get_exponents()
+   header = bytes([grid.grid_height, grid.grid_width])
+   return hashlib.blake2b(header + exponents.tobytes(),
+                          digest_size=BOARD_HASH_SIZE).digest()
+
+# A class for a recorded game: the seed of the game engine, the dimensions of
+# the game grid, the actions as (frame, action) pairs and the final score,
+# pieces placed and board hash
+class Replay:
+   def __init__(self, seed, grid_h, grid_w, actions=None, score=0, pieces=0,
+                board=bytes(BOARD_HASH_SIZE)):
+      self.seed = seed
+      self.grid_height = grid_h
+      self.grid_width = grid_w
+      self.actions = [] if actions is None else actions
+      self.score = score
+      self.pieces = pieces
+      self.board = board
+
+   # A method that returns this replay in the binary format given above
+   def to_bytes(self):
+      data = bytearray(MAGIC)
+      data.append(VERSION)
+      for value in (self.seed, self.grid_height, self.grid_width, len(self.actions)):
+         write_varint(data, value)
+      last_frame = 0
+      for frame, action in self.actions:
+         write_varint(data, ((frame - last_frame) << 3) | ACTION_CODES[action])
+         last_frame = frame
+      write_varint(data, self.score)
+      write_varint(data, self.pieces)
+      data += self.board
+      return bytes(data)
+
+   # A method that creates a replay from the binary format given above
+   @classmethod
+   def from_bytes(cls, data):
+      if data[:len(MAGIC)] != MAGIC:
+         raise ValueError("not a replay file")
+      if data[len(MAGIC)] != VERSION:
+         raise ValueError("unknown replay version: " + str(data[len(MAGIC)]))
+      position = len(MAGIC) + 1
+      values = []
+      for i in range(4):
+         value, position = read_varint(data, position)
+         values.append(value)
+      seed, grid_h, grid_w, n_actions = values
+      actions = []
+      frame = 0
+      for i in range(n_actions):
+         value, position = read_varint(data, position)
+         frame += value >> 3
+         actions.append((frame, ACTIONS[value & 7]))
+      score, position = read_varint(data, position)
+      pieces, position = read_varint(data, position)
+      board = bytes(data[position:position + BOARD_HASH_SIZE])
+      return cls(seed, grid_h, grid_w, actions, score, pieces, board)
+
+   # A method for saving this replay to the given file
+   def save(self, filename):
+      with open(filename, "wb") as file:
+         file.write(self.to_bytes())
+
+   # A method for loading a replay from the given file
+   @classmethod
+   def load(cls, filename):
+      with open(filename, "rb") as file:
+         return cls.from_bytes(file.read())
+
+# the code of each action in the replay files
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+
+# A class for recording the game played by a game engine: the actions are
+# given to the game engine through the step method of the recorder with the
+# frame (tick) in which they happen
+class ReplayRecorder:
+   def __init__(self, engine):
+      self.engine = engine
+      grid = engine.grid
+      self.replay = Replay(engine.seed, grid.grid_height, grid.grid_width)
+
+   # A method that records the given action and applies it to the game engine
+   # (returning the events of the game engine)
+   def step(self, frame, action):
+      self.replay.actions.append((frame, action))
+      return self.engine.step(action)
+
+   # A method that returns a snapshot of the game together with the number
+   # of actions recorded so far
+   def snapshot(self):
+      return self.engine.snapshot(), len(self.replay.actions)
+
+   # A method for going back to a snapshot returned by the snapshot method,
+   # where the actions recorded after it are dropped (so the replay is of the
+   # game as it is played from there on)
+   def restore(self, snapshot):
+      state, n_actions = snapshot
+      self.engine.restore(state)
+      del self.replay.actions[n_actions:]
+
+   # A method that returns the replay with the current score, pieces placed
+   # and board of the game
+   def finish(self):
+      self.replay.score = self.engine.score
+      self.replay.pieces = self.engine.pieces_placed
+      self.replay.board = board_hash(self.engine.grid)
+      return self.replay
+
+# A function that plays the given replay on a new game grid (a BitGrid unless
+# another class is given) and returns the game engine at the end
+def play(replay, grid_class=BitGrid):
+   engine = GameEngine(grid_class(replay.grid_height, replay.grid_width), replay.seed)
+   for frame, action in replay.actions:
+      engine.step(action)
+   return engine
+
+# A function that plays the given replay and returns True when the final
+# score, the pieces placed and the board are the same as the recorded ones
+def verify(replay, grid_class=BitGrid):
+   engine = play(replay, grid_class)
+   return (engine.score == replay.score and engine.pieces_placed == replay.pieces
+           and board_hash(engine.grid) == replay.board)
+
+# A function for writing an integer as an unsigned LEB128 varint
+def write_varint(data, value):
+   while value >= 0x80:
+      data.append((value & 0x7F) | 0x80)
+      value >>= 7
+   data.append(value)
+
+# A function for reading an unsigned LEB128 varint at the given position,
+# which returns the integer and the position after it
+def read_varint(data, position):
+   value, shift = 0, 0
+   while True:
+      byte = data[position]
+      position += 1
+      value |= (byte & 0x7F) << shift
+      if byte < 0x80:
+         return value, position
+      shift += 7
+
+# The main function where this program starts execution
+def main(argv=None):
+   parser = argparse.ArgumentParser(description="Check recorded games of Tetris 2048.")
+   parser.add_argument("files", nargs="+", help="the replay files")
+   args = parser.parse_args(argv)
+   failed = 0
+   for filename in args.files:
+      replay = Replay.load(filename)
+      if verify(replay):
+         print("OK", filename, replay.score)
+      else:
+         failed += 1
+         print("MISMATCH", filename, replay.score)
+   return 1 if failed else 0
+
+if __name__ == '__main__':
+   sys.exit(main())
@@ -0,0 +1,106 @@
+################################################################################
+#                                                                              #
+# Plays headless games of Tetris 2048 under a policy on a pool of processes    #
+#                                                                              #
+# Usage: python selfplay.py --games 1000 --seed 42 [--workers 8]               #
+#                           [--policy module:function] [--game INDEX]          #
+#                                                                              #
+# Each game gets its own seed derived from the master seed and the index of    #
+# the game, so any game can be played again with --seed and --game. The        #
+# results are written as one JSON object per line, in the order of the games, #
+# as soon as each one is ready.                                                #
+#                                                                              #
+################################################################################
+
+import argparse  # for parsing the command line arguments
+import functools  # used for passing the fixed arguments to the workers
+import importlib  # used for loading the policy given on the command line
+import json  # the results are written as JSON lines
+import os  # used for getting the number of cores
+import random  # the policies get a random number generator of their own
+import sys  # the results are written to the standard output
+from concurrent.futures import ProcessPoolExecutor  # the pool of processes
+import numpy as np  # used for deriving the seeds of the games
+from bit_grid import BitGrid  # the headless game grid
+from engine import GameEngine, ACTIONS  # the rules of the game
+
+# A policy is a function that is given the game engine and a random number
+# generator and returns the next action (one of engine.ACTIONS)
+def random_policy(engine, rng):
+   return rng.choice(ACTIONS)
+
+# A function that returns the seed of the game engine and the seed of the
+# policy for the game with the given index (both derived from the master seed)
+def game_seeds(master_seed, index):
+   sequence = np.random.SeedSequence(master_seed, spawn_key=(index,))
+   engine_seed, policy_seed = (int(word) for word in sequence.generate_state(2))
+   return engine_seed, policy_seed
+
+# A function that returns the policy function given as "module:function"
+def load_policy(name):
+   module_name, _, function_name = name.partition(":")
+   return getattr(importlib.import_module(module_name), function_name)
+
+# A function that plays the game with the given index to the end (or until the
+# given number of pieces is placed) and returns its results as a dictionary
+def play_game(master_seed, index, policy_name, grid_h=20, grid_w=12, max_pieces=None):
+   engine_seed, policy_seed = game_seeds(master_seed, index)
+   policy = load_policy(policy_name)
+   rng = random.Random(policy_seed)
+   engine = GameEngine(BitGrid(grid_h, grid_w), engine_seed)
+   steps = 0
+   while not engine.game_over:
+      if max_pieces is not None and engine.pieces_placed >= max_pieces:
+         break
+      engine.step(policy(engine, rng))
+      steps += 1
+   max_exponent = int(engine.grid.exponents.max())
+   return {"game": index, "seed": master_seed, "score": engine.score,
+           "max_tile": 1 << max_exponent if max_exponent else 0,
+           "pieces": engine.pieces_placed, "steps": steps,
+           "won": engine.has_won}
+
+# A function that plays the given games on a pool of worker processes and
+# yields their results in the order of the games as soon as they are ready
+def play_games(master_seed, indexes, policy_name, workers=None, **options):
+   indexes = list(indexes)
+   workers = workers or os.cpu_count() or 1
+   # the games are sent to the workers in chunks when there are many more
+   # games than workers, to keep the cost of passing them around low
+   chunksize = max(1, len(indexes) // (workers * 16))
+   game = functools.partial(play_game, master_seed, policy_name=policy_name, **options)
+   with ProcessPoolExecutor(max_workers=workers) as executor:
+      for result in executor.map(game, indexes, chunksize=chunksize):
+         yield result
+
+# The main function where this program starts execution
+def main(argv=None):
+   parser = argparse.ArgumentParser(description="Play headless games of Tetris 2048.")
+   parser.add_argument("--games", type=int, default=100, help="the number of games")
+   parser.add_argument("--seed", type=int, default=0, help="the master seed")
+   parser.add_argument("--game", type=int, default=None,
+                       help="play only the game with this index (to reproduce it)")
+   parser.add_argument("--workers", type=int, default=None,
+                       help="the number of worker processes (default: all cores)")
+   parser.add_argument("--policy", default="selfplay:random_policy",
+                       help="the policy as module:function")
+   parser.add_argument("--max-pieces", type=int, default=None,
+                       help="stop each game after this many pieces")
+   parser.add_argument("--height", type=int, default=20, help="the grid height")
+   parser.add_argument("--width", type=int, default=12, help="the grid width")
+   args = parser.parse_args(argv)
+
+   # the policy is loaded once here so that a wrong name fails early
+   load_policy(args.policy)
+   options = {"grid_h": args.height, "grid_w": args.width, "max_pieces": args.max_pieces}
+   if args.game is not None:
+      results = [play_game(args.seed, args.game, args.policy, **options)]
+   else:
+      results = play_games(args.seed, range(args.games), args.policy,
+                           args.workers, **options)
+   for result in results:
+      sys.stdout.write(json.dumps(result) + "\n")
+      sys.stdout.flush()
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,182 @@
+################################################################################
+#                                                                              #
+# Tests for the game grids (run with python -m pytest)                         #
+#                                                                              #
+################################################################################
+
+import random  # used for the random games of the differential test
+import numpy as np  # used for the boards of the batch engine
+from game_grid import GameGrid  # the class for modeling the game grid
+from bit_grid import BitGrid  # the headless game grid
+from tetromino import Tetromino  # used for the tetrominoes of the random games
+from autoplayer import make_batch  # used for locking the tetrominoes in a batch
+from tile import Tile  # used for the tiles on the game grids
+
+# A function that returns a game grid with the given columns of tile numbers
+# (from the bottom up, 0 for an empty cell) and the tiles put on it
+def make_grid(columns, grid_h=8):
+   grid = GameGrid(grid_h, len(columns))
+   tiles = {}
+   for col, numbers in enumerate(columns):
+      for row, number in enumerate(numbers):
+         if number:
+            tiles[(row, col)] = grid.tile_matrix[row][col] = Tile(number)
+   grid.sync_row_bits()
+   return grid, tiles
+
+# A function that returns the tile numbers of the given column of a game grid
+# from the bottom up (0 for an empty cell)
+def column_numbers(grid, col):
+   return [0 if tile is None else tile.number for tile in grid.tile_matrix[:, col]]
+
+# A function that returns the tile numbers of the given exponent array as a
+# list of rows (0 for an empty cell)
+def exponent_numbers(exponents):
+   return [[1 << int(exponent) if exponent else 0 for exponent in row] for row in exponents]
+
+# Only the lower tile of the merged pair changes, the tiles above it only fall
+def test_merged_cells_with_slides():
+   grid, tiles = make_grid([[2, 2, 8, 16]])
+   assert grid.merge_vertical_tiles() == 1
+   assert grid.merged_cells == [(0, 0)]
+   assert column_numbers(grid, 0) == [4, 8, 16, 0, 0, 0, 0, 0]
+   assert grid.tile_matrix[0][0] is tiles[(0, 0)]
+   assert grid.tile_matrix[1][0] is tiles[(2, 0)]
+   assert grid.tile_matrix[2][0] is tiles[(3, 0)]
+   assert grid.score == 4
+
+# A tile merged again by a chain is reported once, where it ends up, and the
+# columns with no merges only fall
+def test_merged_cells_with_chains_and_gaps():
+   grid, tiles = make_grid([[8, 4, 2, 2, 32], [2, 0, 4, 16], [4, 2, 8]])
+   assert grid.merge_vertical_tiles() == 3
+   assert sorted(grid.merged_cells) == [(0, 0)]
+   assert column_numbers(grid, 0) == [16, 32, 0, 0, 0, 0, 0, 0]
+   assert grid.tile_matrix[0][0] is tiles[(0, 0)]
+   assert grid.tile_matrix[1][0] is tiles[(4, 0)]
+   # the column with a gap falls once a merge has happened on the grid
+   assert column_numbers(grid, 1) == [2, 4, 16, 0, 0, 0, 0, 0]
+   assert grid.tile_matrix[1][1] is tiles[(2, 1)]
+   assert column_numbers(grid, 2) == [4, 2, 8, 0, 0, 0, 0, 0]
+   assert grid.score == 4 + 8 + 16
+
+# The cells of the merges are those of the last lock only
+def test_merged_cells_are_reset_by_each_lock():
+   grid, tiles = make_grid([[2], [4], [0]])
+   grid.lock_tiles([(Tile(2), (1, 0))])
+   assert grid.merged_cells == [(0, 0)]
+   grid.lock_tiles([(Tile(8), (1, 1))])
+   assert grid.merged_cells == []
+
+# A function that locks the given tile numbers on the given (row, col) cells of
+# a board given as a list of rows of tile numbers (0 for an empty cell) by the
+# rules of the original game grid, one tile at a time and with a depth-first
+# search for the free tiles, and returns the score gained and whether the
+# game is over and won
+def reference_lock(board, numbers_cells):
+   grid_h, grid_w = len(board), len(board[0])
+   score, game_over, has_won = 0, False, False
+   for number, (row, col) in numbers_cells:
+      if 0 <= row < grid_h and 0 <= col < grid_w:
+         board[row][col] = number
+      else:
+         game_over = True
+   # the merges, pass by pass, with gravity after each pass with a merge
+   merged = True
+   while merged:
+      merged = False
+      for col in range(grid_w):
+         row = 0
+         while row < grid_h - 1:
+            if board[row][col] and board[row][col] == board[row + 1][col]:
+               board[row][col] *= 2
+               board[row + 1][col] = 0
+               score += board[row][col]
+               merged = True
+               if board[row][col] == 2048:
+                  game_over = has_won = True
+               row += 2
+               continue
+            row += 1
+      if merged:
+         for col in range(grid_w):
+            stack = [board[row][col] for row in range(grid_h) if board[row][col]]
+            stack += [0] * (grid_h - len(stack))
+            for row in range(grid_h):
+               board[row][col] = stack[row]
+   # the free tiles, which are not connected to the bottom row
+   visited = set()
+   todo = [(0, col) for col in range(grid_w) if board[0][col]]
+   while todo:
+      row, col = todo.pop()
+      if (row, col) in visited:
+         continue
+      visited.add((row, col))
+      for r, c in ((row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)):
+         if 0 <= r < grid_h and 0 <= c < grid_w and board[r][c]:
+            todo.append((r, c))
+   for row in range(grid_h):
+      for col in range(grid_w):
+         if board[row][col] and (row, col) not in visited:
+            score += board[row][col]
+            board[row][col] = 0
+   # the full rows, from the top row down
+   row = grid_h - 1
+   while row >= 0:
+      if all(board[row]):
+         score += sum(board[row])
+         del board[row]
+         board.append([0] * grid_w)
+      else:
+         row -= 1
+   return score, game_over, has_won
+
+# GameGrid, BitGrid, BatchEngine (which locks each tetromino on a batch made
+# from the board before the lock) and the rules of the original game grid
+# give the same boards, scores and flags after each lock of random games
+def test_grids_match_the_original_rules():
+   grid_h, grid_w = 12, 6
+   for seed in range(20):
+      rng = random.Random(seed)
+      game_grid, bit_grid = GameGrid(grid_h, grid_w), BitGrid(grid_h, grid_w)
+      board = [[0] * grid_w for row in range(grid_h)]
+      score, game_over, has_won = 0, False, False
+      while not game_over:
+         tetromino = Tetromino(rng.choice('IOSLJZT'), grid_h, grid_w, rng)
+         for i in range(rng.randrange(4)):
+            tetromino.rotate(game_grid)
+         for i in range(rng.randrange(4)):
+            tetromino.move(rng.choice(("left", "right")), game_grid)
+         # the batch engine drops the tetromino itself and the numbers are
+         # taken before GameGrid merges the tiles
+         batch = make_batch(bit_grid.get_exponents()[None], np.zeros(1, dtype=np.int64),
+                            tetromino, [(0, tetromino.rotation, tetromino.bottom_left_cell.x)],
+                            tetromino.bottom_left_cell.y)
+         tetromino.hard_drop(game_grid)
+         batch.hard_drop(np.arange(1))
+         assert batch.y[0] == tetromino.bottom_left_cell.y
+         batch.settle(np.arange(1))
+         tile_cells = tetromino.get_tile_cells()
+         numbers_cells = [(tile.number, cell) for tile, cell in tile_cells]
+         lock_score, lock_over, lock_won = reference_lock(board, numbers_cells)
+         score, game_over, has_won = score + lock_score, game_over or lock_over, has_won or lock_won
+         bit_grid.lock_tiles(tile_cells)
+         game_grid.lock_tiles(tile_cells)
+         assert exponent_numbers(bit_grid.get_exponents()) == board
+         assert exponent_numbers(batch.boards[0]) == board
+         assert (batch.score[0], batch.game_over[0], batch.has_won[0]) == (lock_score, lock_over,
+                                                                           lock_won)
+         assert [list(row) for row in
+                 zip(*(column_numbers(game_grid, col) for col in range(grid_w)))] == board
+         assert (bit_grid.score, bit_grid.game_over, bit_grid.has_won) == (score, game_over, has_won)
+         assert (game_grid.score, game_grid.game_over, game_grid.has_won) == (score, game_over, has_won)
+
+# A hard drop does not use the landing row of the ghost on another game grid
+def test_hard_drop_on_another_grid():
+   tetromino = Tetromino('O', 8, 4, random.Random(0))
+   tetromino.bottom_left_cell.x = 0
+   empty_grid = BitGrid(8, 4)
+   assert tetromino.get_landing_row(empty_grid) == 0
+   grid, tiles = make_grid([[2, 4], [4, 2], [2], [4]])
+   assert tetromino.hard_drop(grid) == 8 - 1 - 2
+   assert tetromino.bottom_left_cell.y == 2
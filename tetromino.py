@@ -1,162 +1,266 @@
 from tile import Tile  # used for modeling each tile on the tetrominoes
 from point import Point  # used for tile positions
-import copy as cp  # the copy module is used for copying tiles and positions
 import random  # the random module is used for generating random values
 import numpy as np  # the fundamental Python module for scientific computing
 
-# A class for modeling tetrominoes with 3 out of 7 different types as I, O and Z
+# A function that returns the size n of the n x n tile matrix and the occupied
+# (non-empty) cells of this matrix for a given shape (type) in its initial
+# rotation state (see the documentation given with this code)
+def get_occupied_cells(shape):
+   occupied_cells = []
+   if shape == 'I':
+      n = 4  # n = number of rows = number of columns in the tile matrix
+      # shape of the tetromino I in its initial rotation state
+      occupied_cells.append((1, 0))  # (column_index, row_index)
+      occupied_cells.append((1, 1))
+      occupied_cells.append((1, 2))
+      occupied_cells.append((1, 3))
+   elif shape == 'O':
+      n = 2  # n = number of rows = number of columns in the tile matrix
+      # shape of the tetromino O in its initial rotation state
+      occupied_cells.append((0, 0))  # (column_index, row_index)
+      occupied_cells.append((1, 0))
+      occupied_cells.append((0, 1))
+      occupied_cells.append((1, 1))
+   elif shape == 'S':
+      n = 3  # n = number of rows = number of columns in the tile matrix
+      # shape of the tetromino Z in its initial rotation state
+      occupied_cells.append((0, 1))  # (column_index, row_index)
+      occupied_cells.append((1, 1))
+      occupied_cells.append((1, 2))
+      occupied_cells.append((2, 2))
+
+   elif shape == 'L':
+      n = 3
+      occupied_cells.append((0, 0))  # (column_index, row_index)
+      occupied_cells.append((0, 1))
+      occupied_cells.append((0, 2))
+      occupied_cells.append((1, 2))
+
+   elif shape == 'J':
+      n = 3
+      occupied_cells.append((0, 2))  # (column_index, row_index)
+      occupied_cells.append((1, 0))
+      occupied_cells.append((1, 1))
+      occupied_cells.append((1, 2))
+
+   elif shape == 'Z':
+      n = 3
+      occupied_cells.append((0, 1))  # (column_index, row_index)
+      occupied_cells.append((1, 1))
+      occupied_cells.append((1, 0))
+      occupied_cells.append((2, 0))
+
+   elif shape == 'T':
+      n = 3
+      occupied_cells.append((0, 0))  # (column_index, row_index)
+      occupied_cells.append((1,0))
+      occupied_cells.append((2, 0))
+      occupied_cells.append((1, 1))
+   return n, occupied_cells
+
+# A class for the precomputed data of one rotation state of a tetromino shape
+class RotationState:
+   # A constructor that computes the data of the rotation state in which the
+   # tiles of the tetromino are in the given (row_index, column_index) cells of
+   # the n x n tile matrix
+   def __init__(self, n, cells):
+      self.n = n
+      # the cell of each tile (the order of the tiles never changes)
+      self.cells = tuple(cells)
+      # the bounding box of the occupied cells
+      self.min_row = min(row for row, col in cells)
+      self.max_row = max(row for row, col in cells)
+      self.min_col = min(col for row, col in cells)
+      self.max_col = max(col for row, col in cells)
+      # the lowest occupied row above the bottom left cell of the tile matrix
+      self.min_dy = (n - 1) - self.max_row
+      # the occupied columns of each row as a bitmask (bit c for column c)
+      # together with the row position above the bottom left cell
+      masks = {}
+      for row, col in cells:
+         masks[(n - 1) - row] = masks.get((n - 1) - row, 0) | (1 << col)
+      self.row_masks = tuple(sorted(masks.items()))
+      # the tiles that lead a move to the left, to the right and down (the
+      # leftmost and the rightmost tile of each row and the bottommost tile of
+      # each column) as row bitmasks in the same form
+      self.left_edges = tuple((dy, mask & -mask) for dy, mask in self.row_masks)
+      self.right_edges = tuple((dy, 1 << (mask.bit_length() - 1))
+                               for dy, mask in self.row_masks)
+      bottoms = {}
+      for row, col in cells:
+         bottoms[col] = min(bottoms.get(col, n), (n - 1) - row)
+      edges = {}
+      for col, dy in bottoms.items():
+         edges[dy] = edges.get(dy, 0) | (1 << col)
+      self.down_edges = tuple(sorted(edges.items()))
+
+# A function that builds the four rotation states of a tetromino shape, where
+# each rotation moves the tile in cell (row, col) to cell (col, n - 1 - row)
+def build_rotation_states(shape):
+   n, occupied_cells = get_occupied_cells(shape)
+   cells = [(row_index, col_index) for col_index, row_index in occupied_cells]
+   states = []
+   for rotation in range(4):
+      states.append(RotationState(n, cells))
+      cells = [(col, n - 1 - row) for row, col in cells]
+   return tuple(states)
+
+# the rotation states of all the tetromino shapes (built once at import)
+ROTATION_STATES = {shape: build_rotation_states(shape) for shape in 'IOSLJZT'}
+
+# A class for modeling tetrominoes with 7 different types (shapes)
 class Tetromino:
-   # the dimensions of the game grid (defined as class variables)
+   # the default dimensions of the game grid (defined as class variables)
    grid_height, grid_width = None, None
 
-   # A constructor for creating a tetromino with a given shape (type)
-   def __init__(self, shape):
+   # A constructor for creating a tetromino with a given shape (type) for a
+   # game grid with the given dimensions (the class variables are used when
+   # they are not given) by using the given random number generator
+   def __init__(self, shape, grid_height=None, grid_width=None, rng=random):
+      self.grid_height = Tetromino.grid_height if grid_height is None else grid_height
+      self.grid_width = Tetromino.grid_width if grid_width is None else grid_width
       self.type = shape  # set the type of this tetromino
-      # determine the occupied (non-empty) cells in the tile matrix based on
-      # the shape of this tetromino (see the documentation given with this code)
-      occupied_cells = []
-      if self.type == 'I':
-         n = 4  # n = number of rows = number of columns in the tile matrix
-         # shape of the tetromino I in its initial rotation state
-         occupied_cells.append((1, 0))  # (column_index, row_index)
-         occupied_cells.append((1, 1))
-         occupied_cells.append((1, 2))
-         occupied_cells.append((1, 3))
-      elif self.type == 'O':
-         n = 2  # n = number of rows = number of columns in the tile matrix
-         # shape of the tetromino O in its initial rotation state
-         occupied_cells.append((0, 0))  # (column_index, row_index)
-         occupied_cells.append((1, 0))
-         occupied_cells.append((0, 1))
-         occupied_cells.append((1, 1))
-      elif self.type == 'S':
-         n = 3  # n = number of rows = number of columns in the tile matrix
-         # shape of the tetromino Z in its initial rotation state
-         occupied_cells.append((0, 1))  # (column_index, row_index)
-         occupied_cells.append((1, 1))
-         occupied_cells.append((1, 2))
-         occupied_cells.append((2, 2))
-
-      elif self.type == 'L':
-         n = 3
-         occupied_cells.append((0, 0))  # (column_index, row_index)
-         occupied_cells.append((0, 1))
-         occupied_cells.append((0, 2))
-         occupied_cells.append((1, 2))
-
-      elif self.type == 'J':
-         n = 3
-         occupied_cells.append((0, 2))  # (column_index, row_index)
-         occupied_cells.append((1, 0))
-         occupied_cells.append((1, 1))
-         occupied_cells.append((1, 2))
-
-      elif self.type == 'Z':
-         n = 3
-         occupied_cells.append((0, 1))  # (column_index, row_index)
-         occupied_cells.append((1, 1))
-         occupied_cells.append((1, 0))
-         occupied_cells.append((2, 0))
-
-      elif self.type == 'T':
-         n = 3
-         occupied_cells.append((0, 0))  # (column_index, row_index)
-         occupied_cells.append((1,0))
-         occupied_cells.append((2, 0))
-         occupied_cells.append((1, 1))
-      # create a matrix of numbered tiles based on the shape of this tetromino
-      self.tile_matrix = np.full((n, n), None)
-      # create the four tiles (minos) of this tetromino and place these tiles
-      # into the tile matrix
-      for i in range(len(occupied_cells)):
-         col_index, row_index = occupied_cells[i][0], occupied_cells[i][1]
-         # create a tile for each occupied cell of this tetromino
-         self.tile_matrix[row_index][col_index] = Tile()
+      # the precomputed rotation states of this shape and the current one
+      self.rotation_states = ROTATION_STATES[shape]
+      self.rotation = 0
+      n = self.rotation_states[0].n
+      # create the four tiles (minos) of this tetromino, one for each occupied
+      # cell of the initial rotation state
+      self.tiles = [Tile(rng.choice([2, 4])) for cell in self.rotation_states[0].cells]
       # initialize the position of this tetromino (as the bottom left cell in
       # the tile matrix) with a random horizontal position above the game grid
       self.bottom_left_cell = Point()
-      self.bottom_left_cell.y = Tetromino.grid_height - 1
-      self.bottom_left_cell.x = random.randint(0, Tetromino.grid_width - n)
+      self.bottom_left_cell.y = self.grid_height - 1
+      self.bottom_left_cell.x = rng.randint(0, self.grid_width - n)
+      # the landing row for the last position (see get_landing_row)
+      self.landing_key, self.landing_row = None, None
+
+   # A method that returns the state of this tetromino as an immutable tuple
+   # (type, rotation, x, y, tile numbers)
+   def get_state(self):
+      return (self.type, self.rotation, self.bottom_left_cell.x,
+              self.bottom_left_cell.y, tuple(tile.number for tile in self.tiles))
+
+   # A method for creating a tetromino from a state returned by get_state
+   # (without using any random number generator)
+   @classmethod
+   def from_state(cls, state, grid_height=None, grid_width=None):
+      shape, rotation, x, y, numbers = state
+      tetromino = cls.__new__(cls)
+      tetromino.grid_height = Tetromino.grid_height if grid_height is None else grid_height
+      tetromino.grid_width = Tetromino.grid_width if grid_width is None else grid_width
+      tetromino.type = shape
+      tetromino.rotation_states = ROTATION_STATES[shape]
+      tetromino.rotation = rotation
+      tetromino.tiles = [Tile(number) for number in numbers]
+      tetromino.bottom_left_cell = Point(x, y)
+      tetromino.landing_key, tetromino.landing_row = None, None
+      return tetromino
 
    # A method that computes and returns the position of the cell in the tile
-   # matrix specified by the given row and column indexes
-   def get_cell_position(self, row, col):
-      n = len(self.tile_matrix)  # n = number of rows = number of columns
-      position = Point()
+   # matrix specified by the given row and column indexes (the given point is
+   # moved there when there is one, so that no point is created)
+   def get_cell_position(self, row, col, position=None):
+      n = self.rotation_states[self.rotation].n  # n = number of rows = columns
+      if position is None:
+         position = Point()
       # horizontal position of the cell
       position.x = self.bottom_left_cell.x + col
       # vertical position of the cell
       position.y = self.bottom_left_cell.y + (n - 1) - row
       return position
 
+   # A method that returns the tiles of this tetromino together with the
+   # (row, col) cells of the game grid they are on (or would be on when the
+   # bottom left cell was at row y)
+   def get_tile_cells(self, y=None):
+      n = self.rotation_states[self.rotation].n
+      x = self.bottom_left_cell.x
+      y = self.bottom_left_cell.y if y is None else y
+      return [(tile, (y + (n - 1) - row, x + col))
+              for tile, (row, col) in zip(self.tiles, self.rotation_states[self.rotation].cells)]
+
    # A method to return a copy of the tile matrix without any empty row/column,
    # and the position of the bottom left cell when return_position is set
+   # (the game engine locks the tiles with get_tile_cells, without copies)
    def get_min_bounded_tile_matrix(self, return_position=False):
-      n = len(self.tile_matrix)  # n = number of rows = number of columns
-      # determine rows and columns to copy (omit empty rows and columns)
-      min_row, max_row, min_col, max_col = n - 1, 0, n - 1, 0
-      for row in range(n):
-         for col in range(n):
-            if self.tile_matrix[row][col] is not None:
-               if row < min_row:
-                  min_row = row
-               if row > max_row:
-                  max_row = row
-               if col < min_col:
-                  min_col = col
-               if col > max_col:
-                  max_col = col
-      # copy the tiles from the tile matrix of this tetromino
-      copy = np.full((max_row - min_row + 1, max_col - min_col + 1), None)
-      for row in range(min_row, max_row + 1):
-         for col in range(min_col, max_col + 1):
-            if self.tile_matrix[row][col] is not None:
-               row_ind = row - min_row
-               col_ind = col - min_col
-               copy[row_ind][col_ind] = cp.deepcopy(self.tile_matrix[row][col])
+      # the rows and columns to copy are the precomputed bounding box of the
+      # occupied cells in the rotation state (omit empty rows and columns)
+      state = self.rotation_states[self.rotation]
+      copy = np.full((state.max_row - state.min_row + 1,
+                      state.max_col - state.min_col + 1), None)
+      # copy the tiles of this tetromino
+      for tile, (row, col) in zip(self.tiles, state.cells):
+         copy[row - state.min_row][col - state.min_col] = tile.copy()
       # return just the matrix copy when return_position is not set (as True)
       # the argument return_position defaults to False when a value is not given
       if not return_position:
          return copy
       # otherwise return the position of the bottom left cell in copy as well
       else:
-         blc_position = cp.copy(self.bottom_left_cell)
-         blc_position.translate(min_col, (n - 1) - max_row)
+         blc_position = Point(self.bottom_left_cell.x + state.min_col,
+                              self.bottom_left_cell.y + state.min_dy)
          return copy, blc_position
 
    # A method for drawing the tetromino on the game grid
    def draw(self):
-      n = len(self.tile_matrix)  # n = number of rows = number of columns
-      for row in range(n):
-         for col in range(n):
-            # draw each occupied cell as a tile on the game grid
-            if self.tile_matrix[row][col] is not None:
-               # get the position of the tile
-               position = self.get_cell_position(row, col)
-               # draw only the tiles that are inside the game grid
-               if position.y < Tetromino.grid_height:
-                  self.tile_matrix[row][col].draw(position)
+      state = self.rotation_states[self.rotation]
+      position = None  # the same point is used for all the tiles
+      for tile, (row, col) in zip(self.tiles, state.cells):
+         # get the position of the tile
+         position = self.get_cell_position(row, col, position)
+         # draw only the tiles that are inside the game grid
+         if position.y < self.grid_height:
+            tile.draw(position)
+
+   # A method for drawing the ghost piece, which shows the outlines of the
+   # tiles of this tetromino where it would land
+   def draw_ghost(self, game_grid):
+      import lib.stddraw as stddraw  # only needed when the game is drawn
+      for tile, (row, col) in self.get_tile_cells(self.get_landing_row(game_grid)):
+         if row < self.grid_height:
+            stddraw.setPenColor(tile.box_color)
+            stddraw.setPenRadius(Tile.boundary_thickness)
+            stddraw.square(col, row, 0.45)
+            stddraw.setPenRadius()
+
+   # A method for checking if this tetromino fits on the game grid in the
+   # given rotation state with its bottom left cell at (x, y), by using the
+   # precomputed row bitmasks and the row bitmasks of the game grid
+   def can_be_placed(self, game_grid, rotation, x, y):
+      state = self.rotation_states[rotation]
+      # the tiles must be inside the game grid horizontally and above its bottom
+      if x + state.min_col < 0 or x + state.max_col >= self.grid_width:
+         return False
+      if y + state.min_dy < 0:
+         return False
+      # the tiles must not collide with the tiles on the game grid
+      return self.are_cells_free(game_grid, state.row_masks, x, y)
 
+   # A method for checking if the cells given by row bitmasks (as in the
+   # rotation states) are free on the game grid when the bottom left cell is
+   # at (x, y), where the rows above the game grid are always free
+   def are_cells_free(self, game_grid, row_masks, x, y):
+      grid_rows = game_grid.row_bits
+      for dy, mask in row_masks:
+         if y + dy < self.grid_height:
+            # the first occupied column can be on the right of the bottom left
+            # cell, so the bottom left cell can be outside the game grid
+            mask = mask << x if x >= 0 else mask >> -x
+            if grid_rows[y + dy] & mask:
+               return False
+      return True
+
+   # A method for rotating this tetromino clockwise by 90 degrees when the
+   # rotated tetromino fits on the game grid
    def rotate(self, game_grid):
-      n = len(self.tile_matrix)
-
-      rotated = np.full((n,n), None)
-      for row in range(n):
-         for col in range(n):
-            rotated[col][n-1-row] = self.tile_matrix[row][col]
-
-      #check where it would appear on the grid
-      for row in range(n):
-         for col in range(n):
-            tile = rotated[row][col]
-            if tile is not None:
-               pos = self.get_cell_position(row, col)
-               if pos.x < 0 or pos.x >= Tetromino.grid_width or pos.y < 0:
-                  return  # Outside grid
-               if pos.y < Tetromino.grid_height and game_grid.is_occupied(pos.y, pos.x):
-                  return  # Collision with existing tile
-
-      self.tile_matrix = rotated
+      rotation = (self.rotation + 1) % 4
+      if not self.can_be_placed(game_grid, rotation, self.bottom_left_cell.x,
+                                self.bottom_left_cell.y):
+         return False  # Outside grid or collision with existing tile
+      self.rotation = rotation
+      return True
 
    # A method for moving this tetromino in a given direction by 1 on the grid
    def move(self, direction, game_grid):
@@ -173,58 +277,47 @@ class Tetromino:
          self.bottom_left_cell.y -= 1
       return True  # a successful move in the given direction
 
+   # A method for dropping this tetromino as far down as it can go, which
+   # returns the number of rows it has fallen (the landing row is computed by
+   # the game grid from the heights of its columns, without the cache of
+   # get_landing_row, as the given game grid may not be the one of the ghost)
    def hard_drop(self, game_grid):
-      while self.move("down", game_grid):
-         pass
+      rows = self.bottom_left_cell.y - game_grid.get_landing_row(
+         self.rotation_states[self.rotation], self.bottom_left_cell.x, self.bottom_left_cell.y)
+      self.bottom_left_cell.y -= rows
+      return rows
+
+   # A method that returns the row to which this tetromino would drop from
+   # its position on the game grid it is falling on (for the ghost piece),
+   # which is computed again only after the tetromino has moved or rotated
+   # (the game grid does not change while the tetromino is falling)
+   def get_landing_row(self, game_grid):
+      key = (self.rotation, self.bottom_left_cell.x, self.bottom_left_cell.y)
+      if key != self.landing_key:
+         self.landing_key = key
+         self.landing_row = game_grid.get_landing_row(
+            self.rotation_states[self.rotation], *key[1:])
+      return self.landing_row
 
    # A method for checking if this tetromino can be moved in a given direction
+   # (only the grid cells in front of the leading tiles are checked)
    def can_be_moved(self, direction, game_grid):
-      n = len(self.tile_matrix)  # n = number of rows = number of columns
+      state = self.rotation_states[self.rotation]
+      x, y = self.bottom_left_cell.x, self.bottom_left_cell.y
       # check for moving left or right
-      if direction == "left" or direction == "right":
-         for row_index in range(n):
-            for col_index in range(n):
-               # direction = left --> check the leftmost tile of each row
-               row, col = row_index, col_index
-               if direction == "left" and self.tile_matrix[row][col] is not None:
-                  # the position of the leftmost tile of the current row
-                  leftmost = self.get_cell_position(row, col)
-                  # if any leftmost tile is at x = 0
-                  if leftmost.x == 0:
-                     return False  # this tetromino cannot be moved left
-                  # if the grid cell on the left of a leftmost tile is occupied
-                  if game_grid.is_occupied(leftmost.y, leftmost.x - 1):
-                     return False  # this tetromino cannot be moved left
-                  # as the leftmost tile of the current row is checked
-                  break  # end the inner for loop
-               # direction = right --> check the rightmost tile of each row
-               row, col = row_index, n - 1 - col_index
-               if direction == "right" and self.tile_matrix[row][col] is not None:
-                  # the position of the rightmost tile of the current row
-                  rightmost = self.get_cell_position(row, col)
-                  # if any rightmost tile is at x = grid_width - 1
-                  if rightmost.x == Tetromino.grid_width - 1:
-                     return False  # this tetromino cannot be moved right
-                  # if the grid cell on the right of a rightmost tile is occupied
-                  if game_grid.is_occupied(rightmost.y, rightmost.x + 1):
-                     return False  # this tetromino cannot be moved right
-                  # as the rightmost tile of the current row is checked
-                  break  # end the inner for loop
+      if direction == "left":
+         # if any leftmost tile is at x = 0
+         if x + state.min_col == 0:
+            return False  # this tetromino cannot be moved left
+         return self.are_cells_free(game_grid, state.left_edges, x - 1, y)
+      elif direction == "right":
+         # if any rightmost tile is at x = grid_width - 1
+         if x + state.max_col == self.grid_width - 1:
+            return False  # this tetromino cannot be moved right
+         return self.are_cells_free(game_grid, state.right_edges, x + 1, y)
       # direction = down --> check the bottommost tile of each column
       else:
-         for col in range(n):
-            for row in range(n - 1, -1, -1):
-               # if the current cell of the tetromino is occupied by a tile
-               if self.tile_matrix[row][col] is not None:
-                  # the position of the bottommost tile of the current col
-                  bottommost = self.get_cell_position(row, col)
-                  # if any bottommost tile is at y = 0
-                  if bottommost.y == 0:
-                     return False  # this tetromino cannot be moved down
-                  # if the grid cell below any bottommost tile is occupied
-                  if game_grid.is_occupied(bottommost.y - 1, bottommost.x):
-                     return False  # this tetromino cannot be moved down
-                  # as the bottommost tile of the current row is checked
-                  break  # end the inner for loop
-      # if this method does not end by returning False before this line
-      return True  # this tetromino can be moved in the given direction
+         # if any bottommost tile is at y = 0
+         if y + state.min_dy == 0:
+            return False  # this tetromino cannot be moved down
+         return self.are_cells_free(game_grid, state.down_edges, x, y - 1)
@@ -1,4 +1,3 @@
-import lib.stddraw as stddraw  # used for drawing the tiles to display them
 from lib.color import Color  # used for coloring the tiles
 import random
 
@@ -10,24 +9,45 @@ class Tile:
    boundary_thickness = 0.004
    # font family and font size used for displaying the tile number
    font_family, font_size = "Arial", 14
+   # the attributes of the tiles (no __dict__, as there are many tiles)
+   __slots__ = ("number", "background_color", "foreground_color", "box_color")
 
-   # A constructor that creates a tile with 2 as the number on it
-   def __init__(self):
+   # A constructor that creates a tile with the given number on it (a random
+   # 2 or 4 when the number is not given)
+   def __init__(self, number=None):
       # set the number on this tile
-      self.number = random.choice([2, 4])
+      if number is None:
+         number = random.choice([2, 4])
+      self.number = number
       # set the colors of this tile
       if self.number == 2:
-         self.background_color = Color(255, 209, 220)
-         self.foreground_color = Color(231, 84, 128)
-         self.box_color = Color(231, 84, 128)
-      elif self.number == 4:
-         self.background_color = Color(255, 182, 193)  # blush pink
-         self.foreground_color = Color(200, 80, 120)
-         self.box_color = Color(200, 80, 120)
+         self.background_color, self.foreground_color, self.box_color = NEW_TILE_COLORS
+      else:
          self.set_color_by_number()
 
+   # A method that returns a copy of this tile (the colors are shared with it,
+   # as the colors of a tile are replaced but never changed)
+   def copy(self):
+      tile = Tile.__new__(Tile)
+      tile.number = self.number
+      tile.background_color = self.background_color
+      tile.foreground_color = self.foreground_color
+      tile.box_color = self.box_color
+      return tile
+
    # A method for drawing this tile at a given position with a given length
    def draw(self, position, length=1):  # length defaults to 1
+      # stddraw is imported here so that the game logic can run without a display
+      import lib.stddraw as stddraw
+      # each look of a tile (its number and colors) is drawn once for each
+      # length and then copied from the sprite cache of stddraw (the colors
+      # are compared by their components)
+      key = (self.number, self.background_color, self.foreground_color, self.box_color)
+      stddraw.cachedDrawing(key, position.x, position.y, length, length,
+                            lambda: self.render(stddraw, position, length))
+
+   # A method for drawing this tile with stddraw primitives
+   def render(self, stddraw, position, length):
       # draw the tile as a filled square
       stddraw.setPenColor(self.background_color)
       stddraw.filledSquare(position.x, position.y, length / 2)
@@ -42,58 +62,36 @@ class Tile:
       stddraw.setFontSize(Tile.font_size)
       stddraw.text(position.x, position.y, str(self.number))
 
+   # A method for setting the colors of this tile for its number (the colors
+   # are shared by all the tiles with the same number, see PALETTE)
    def set_color_by_number(self):
-      if self.number == 2:
-         self.background_color = Color(244, 217, 208)  # F4D9D0 - soft blush
-         self.foreground_color = Color(146, 26, 64)  # 921A40 - deep wine
-         self.box_color = Color(146, 26, 64)
-
-      elif self.number == 4:
-         self.background_color = Color(247, 200, 192)  # D9ABAB - pink beige
-         self.foreground_color = Color(146, 26, 64)
-         self.box_color = Color(146, 26, 64)
-
-      elif self.number == 8:
-         self.background_color = Color(199, 91, 122)  # C75B7A - rose
-         self.foreground_color = Color(110, 20, 40)
-         self.box_color = Color(110, 20, 40)
-
-      elif self.number == 16:
-         self.background_color = Color(146, 26, 64)  # 921A40 - deep wine
-         self.foreground_color = Color(244, 217, 208)
-         self.box_color = Color(244, 217, 208)
-
-      elif self.number == 32:
-         self.background_color = Color(110, 20, 50)  # deeper burgundy
-         self.foreground_color = Color(244, 217, 208)
-         self.box_color = Color(244, 217, 208)
-
-      elif self.number == 64:
-         self.background_color = Color(90, 15, 40)  # rich plum-brown
-         self.foreground_color = Color(217, 171, 171)
-         self.box_color = Color(217, 171, 171)
-
-      elif self.number == 128:
-         self.background_color = Color(70, 10, 30)  # dark red-brown
-         self.foreground_color = Color(199, 91, 122)
-         self.box_color = Color(199, 91, 122)
-
-      elif self.number == 256:
-         self.background_color = Color(50, 5, 20)  # near black-cherry
-         self.foreground_color = Color(217, 171, 171)
-         self.box_color = Color(217, 171, 171)
-
-      elif self.number == 512:
-         self.background_color = Color(30, 0, 10)  # very dark wine
-         self.foreground_color = Color(244, 217, 208)
-         self.box_color = Color(244, 217, 208)
+      colors = PALETTE.get(self.number)
+      if colors is None:
+         if self.number < 2048:
+            return  # no colors for this number
+         colors = PALETTE[2048]
+      self.background_color, self.foreground_color, self.box_color = colors
 
-      elif self.number == 1024:
-         self.background_color = Color(20, 0, 0)  # deep red-black
-         self.foreground_color = Color(255, 255, 255)  # white
-         self.box_color = Color(255, 255, 255)
+# A function that returns the (background, foreground, box) colors of a tile
+# with the given (red, green, blue) background and foreground colors, where the
+# box has the color of the foreground
+def _colors(background, foreground):
+   foreground = Color(*foreground)
+   return Color(*background), foreground, foreground
 
-      elif self.number == 2048:
-         self.background_color = Color(10, 0, 0)  # ultra-dark brown
-         self.foreground_color = Color(255, 255, 255)
-         self.box_color = Color(255, 255, 255)
+# the colors of the tiles for each number, which are created only once
+PALETTE = {
+   2: _colors((244, 217, 208), (146, 26, 64)),  # F4D9D0 - soft blush, deep wine
+   4: _colors((247, 200, 192), (146, 26, 64)),  # D9ABAB - pink beige
+   8: _colors((199, 91, 122), (110, 20, 40)),  # C75B7A - rose
+   16: _colors((146, 26, 64), (244, 217, 208)),  # 921A40 - deep wine
+   32: _colors((110, 20, 50), (244, 217, 208)),  # deeper burgundy
+   64: _colors((90, 15, 40), (217, 171, 171)),  # rich plum-brown
+   128: _colors((70, 10, 30), (199, 91, 122)),  # dark red-brown
+   256: _colors((50, 5, 20), (217, 171, 171)),  # near black-cherry
+   512: _colors((30, 0, 10), (244, 217, 208)),  # very dark wine
+   1024: _colors((20, 0, 0), (255, 255, 255)),  # deep red-black, white
+   2048: _colors((10, 0, 0), (255, 255, 255)),  # ultra-dark brown
+}
+# the colors of a new tile with the number 2 (before it is merged)
+NEW_TILE_COLORS = _colors((255, 209, 220), (231, 84, 128))